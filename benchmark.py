@@ -0,0 +1,186 @@
+"""Benchmarks ecdf.py on synthetic data made by makeData.py.
+The program should be invoked in the following manner:
+
+python benchmark.py --sizes 10000,100000,1000000 --engine python --jobs 1 --output results.json
+
+For every size, a data set with that many rows is made (and kept in --data-dir for the next run), and then
+parseArg, getData, makeECDF and printECDF are timed one after the other, as ecdf.py runs them. Each size runs
+in a fresh Python process so that its peak memory (resident set size) is its own. The results are saved as JSON:
+
+{"python": "3.11.7", "numpy": "2.4.6", "results": [{"rows": 10000, "engine": "python", "jobs": 1,
+  "seconds": {"parseArg": ..., "getData": ..., "makeECDF": ..., "printECDF": ...},
+  "rows_per_second": ..., "peak_rss_mb": ...}, ...]}
+
+With --compare old.json, every stage that got slower than in old.json by more than --tolerance (0.2 is 20%)
+is reported, and the program exits with status 1, so that regressions between versions can be caught.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import multiprocessing
+
+from ecdf import InvalidArgumentError, FileError, parseOptions, parseArg, getData, makeECDF, printECDF, _checkEngine, _checkJobs
+from makeData import makeData, schoolNames
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#The options understood by this program, and the type of the value each one takes
+OPTIONS = {"--sizes": str, "--schools": int, "--students": int, "--duplicates": float, "--engine": str, "--jobs": int,
+           "--data-dir": str, "--output": str, "--compare": str, "--tolerance": float}
+
+STAGES = ("parseArg", "getData", "makeECDF", "printECDF")
+
+#Differences smaller than this many seconds are never reported as regressions
+NOISE = 0.01
+
+
+def dataSet(directory, rows, schools, students, duplicates):
+    """Returns the path of a data set with these parameters, making it first if it is not in directory yet"""
+
+    path = os.path.join(directory, "data_%d_%d_%d_%g.csv" % (rows, schools, students, duplicates))
+    if not os.path.exists(path):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        temporary = path + "." + str(os.getpid())
+        makeData(temporary, rows, schools, students, duplicates)
+        os.replace(temporary, path)
+    return path
+
+
+def peakRSS():
+    """The peak resident set size of this process in megabytes, or None where the resource module is missing"""
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #Linux reports kilobytes and macOS bytes
+    return peak / (1024.0*1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def timeStages(path, school, engine = "python", jobs = 1):
+    """Runs the four stages of ecdf.py on one file, and returns the seconds each one took"""
+
+    seconds = {}
+    start = time.perf_counter()
+    school, files = parseArg(["ecdf.py", "--school", school, path])
+    seconds["parseArg"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    data = getData(school, files, jobs, engine, sort = False)
+    seconds["getData"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ecdf = makeECDF(data, presorted = False)
+    seconds["makeECDF"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    printECDF(school, ecdf)
+    seconds["printECDF"] = time.perf_counter() - start
+    return seconds
+
+
+def _runOne(arguments):
+    """Times one data set. This runs in a fresh process, so that the peak memory is that of this data set only"""
+
+    path, rows, school, engine, jobs = arguments
+    seconds = timeStages(path, school, engine, jobs)
+    return {"rows": rows, "engine": engine, "jobs": jobs, "seconds": seconds,
+            "rows_per_second": rows / seconds["getData"], "peak_rss_mb": peakRSS()}
+
+
+def runBenchmarks(sizes, directory, schools = 6, students = 120, duplicates = 0.0, engine = "python", jobs = 1):
+    """Makes the data sets and times each of them. Returns the results as a dictionary ready to be saved as JSON"""
+
+    if not sizes or not all([isinstance(rows, int) and rows > 0 for rows in sizes]):
+        raise InvalidArgumentError("The sizes must be positive integers")
+    _checkEngine(engine)
+    _checkJobs(jobs)
+
+    school = schoolNames(schools)[0]
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for rows in sizes:
+        path = dataSet(directory, rows, schools, students, duplicates)
+        pool = context.Pool(1)
+        try:
+            results.append(pool.apply(_runOne, ((path, rows, school, engine, jobs),)))
+        finally:
+            pool.close()
+            pool.join()
+
+    return {"python": platform.python_version(), "numpy": None if np is None else np.__version__,
+            "schools": schools, "students": students, "duplicates": duplicates, "results": results}
+
+
+def compareResults(old, new, tolerance = 0.2):
+    """Returns a list of messages, one for each stage that is slower in new than in old by more than tolerance. Only results with the same rows, engine and jobs are compared"""
+
+    before = dict(((result["rows"], result["engine"], result["jobs"]), result) for result in old["results"])
+    regressions = []
+    for result in new["results"]:
+        key = (result["rows"], result["engine"], result["jobs"])
+        if key not in before:
+            continue
+        for stage in STAGES:
+            was = before[key]["seconds"][stage]
+            now = result["seconds"][stage]
+            if now > was * (1 + tolerance) and now - was > NOISE:
+                regressions.append("%s on %d rows (engine %s, jobs %d): %.3fs -> %.3fs" % (stage, key[0], key[1], key[2], was, now))
+    return regressions
+
+
+def printResults(results):
+    """Prints the results as a table"""
+
+    print("rows\tengine\tjobs\t" + "\t".join(STAGES) + "\trows/s\tpeak MB")
+    for result in results["results"]:
+        seconds = "\t".join(["%.4f" % result["seconds"][stage] for stage in STAGES])
+        peak = "-" if result["peak_rss_mb"] is None else "%.1f" % result["peak_rss_mb"]
+        print("%d\t%s\t%d\t%s\t%.0f\t%s" % (result["rows"], result["engine"], result["jobs"], seconds, result["rows_per_second"], peak))
+
+
+def main(argv):
+    options, argv = parseOptions(argv, OPTIONS)
+    if len(argv) != 1:
+        raise InvalidArgumentError("""This program must be run with the following format: \npython benchmark.py --sizes 10000,100000 --output results.json""")
+    try:
+        sizes = [int(rows) for rows in options.get("sizes", "10000,100000").split(",")]
+    except ValueError:
+        raise InvalidArgumentError("The sizes must be a list of integers, such as 10000,100000")
+
+    directory = options.get("data_dir", os.path.join(tempfile.gettempdir(), "ecdf_benchmark"))
+    results = runBenchmarks(sizes, directory, options.get("schools", 6), options.get("students", 120), options.get("duplicates", 0.0),
+                            options.get("engine", "python"), options.get("jobs", 1))
+    printResults(results)
+
+    if "output" in options:
+        with open(options["output"], "w") as f:
+            json.dump(results, f, indent = 1)
+
+    if "compare" in options:
+        try:
+            with open(options["compare"]) as f:
+                old = json.load(f)
+        except (IOError, ValueError):
+            raise FileError("Could not read the results in "+options["compare"])
+        regressions = compareResults(old, results, options.get("tolerance", 0.2))
+        for regression in regressions:
+            print("Slower: " + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
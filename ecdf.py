@@ -3,6 +3,75 @@ The program should be invoked in the following manner:
 
 python ecdf.py --school "Port Chester University" input_file1.csv input_file2.csv
 
+or, to print the percentiles of every school found in the files while reading them only once:
+
+python ecdf.py --all-schools input_file1.csv input_file2.csv
+
+Adding --jobs 4 before the other arguments reads the files with 4 worker processes,
+and --engine numpy parses the files with NumPy instead of line by line in Python.
+The numpy engine and snapshots need student ids that fit in 64 bits.
+With --approx 0.01 the percentiles are estimated from a quantile sketch of bounded size,
+and may be off by up to 1% of the number of students in rank.
+
+The files may also be compressed with gzip, bzip2 or xz (file1.csv.gz, file1.csv.bz2, file1.csv.xz).
+They are then decompressed while they are read, on a background thread, without writing them to disk.
+
+With --cache, the parsed files are cached in a binary form in ~/.cache/ecdf (or the directory given
+with --cache-dir, which also turns the cache on), so that later runs over the same files do not have
+to parse them again. The first run pays for writing the cache. --cache-size sets the size of the
+cache in megabytes, --no-cache turns the cache off again and --clear-cache empties it.
+
+Without the cache, a query for one school only parses the lines that contain the name of the school,
+skipping the others after a byte search. --strict parses and checks every line, as a run over all
+schools would.
+
+--course Math keeps only the test scores of one course, and --from 2015-03 --to 2015-05 only those of
+the tests taken between these dates (both included; a date may be a day, a month or a year).
+--index keeps an index of where the lines of each school, course and month are in each file, in the
+cache directory, so that later queries only read the parts of the files they need. The indexes count
+towards --cache-size. The lines in the parts that are skipped are not checked, so --index cannot be
+used with --strict.
+
+--method linear interpolates between the two scores around each percentile instead of taking the
+lower one; nearest and midpoint are the other methods, with the meaning they have in np.quantile.
+--quantiles 0.1,0.5,0.9 asks for these quantiles (fractions from 0 to 1) instead of the 100
+percentiles, and labels each row of the output with its quantile.
+
+--format csv, --format jsonl or --format npy write the percentiles in that format instead
+of the layout above, and --output results.csv writes them to a file instead of the screen.
+The file is only opened once all the input files were read, so a query that fails leaves it as it was.
+
+With --snapshot state.snap, the sums and counts of every student are kept in state.snap.
+A later run with the same snapshot only reads the files that were not read before, so
+
+python ecdf.py --snapshot state.snap --school "Port Chester University" day2.csv
+
+prints the percentiles over all the days so far. Snapshots made on different machines
+from different files can be combined with
+
+python ecdf.py merge all.snap machine1.snap machine2.snap
+
+--stats prints the time spent in each stage (reading, parsing, merging, selecting, output...),
+the rows read from each file and the peak memory to the standard error, and --stats-json stats.json
+saves the same report as JSON. The percentiles printed are not changed.
+
+Many queries can be run at once, parsing each file they need only once, with
+
+python ecdf.py --batch manifest.json
+
+where manifest.json lists the queries and the file each one writes (see loadManifest):
+
+{"queries": [{"school": "ABC University", "files": ["file1.csv", "file2.csv"], "output": "abc.txt"},
+             {"school": "XYZ University", "files": ["file2.csv"], "output": "xyz.csv", "format": "csv", "course": "Math"}]}
+
+Each query sets its own output, format, method, quantiles and filter, and two queries cannot write the same
+file, so --format, --output, --method, --quantiles, --approx, --course, --from, --to, --index, --strict and
+--snapshot cannot be used with --batch.
+
+To answer many queries without reading the files each time, run a server (see ecdf_server.py):
+
+python ecdf.py serve --port 8000 input_file1.csv input_file2.csv
+
 Where the csv files should have lines in the following form (without headers):
 
 student_id,course_name,school_name,test_date,test_score
@@ -20,20 +89,269 @@ percentile    mean_test_score
 
 """
 
+import io
+import os
+import re
 import sys
+import csv
+import mmap
+import queue
+import json
+import math
+import struct
+import hashlib
+import random
+import bisect
+import time
+import locale
+import operator
+import threading
+from itertools import islice
+from contextlib import contextmanager
+from array import array
+from functools import partial
+from multiprocessing import Pool
+
+#NumPy is only needed for the numpy engine
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#Compressed input files need these modules, which are optional parts of the standard library
+try:
+    import zlib
+except ImportError:
+    zlib = None
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+#The resource module, used to report the peak memory, is not available on every platform
+try:
+    import resource
+except ImportError:
+    resource = None
 
 #Define two error classes that can be raised for invalid arguments and file errors
 class InvalidArgumentError(ValueError): pass
 class FileError(IOError): pass
 
-def parseArg(argv):
-    """Parses the command line arguments. Checks for errors and returns a tuple (school, [files, to, search])"""
+
+class StudentAggregate(object):
+    """Keeps a running sum and count of the test scores of each student. The sums and counts are stored in two compact arrays, and index maps a student_id to its row in them, so the memory used depends only on the number of distinct students and not on the number of lines read"""
+
+    __slots__ = ("index", "sums", "counts")
+
+    def __init__(self):
+        self.index = {}
+        self.sums = array("d")
+        self.counts = array("q")
+
+    def __len__(self):
+        return len(self.sums)
+
+    def add(self, student_id, score):
+        """Adds one test score of one student"""
+        row = self.index.get(student_id)
+        if row is None:
+            self.index[student_id] = len(self.sums)
+            self.sums.append(score)
+            self.counts.append(1)
+        else:
+            self.sums[row] += score
+            self.counts[row] += 1
+
+    def merge(self, other):
+        """Adds the sums and counts of another StudentAggregate to this one"""
+        for student_id, other_row in other.index.items():
+            row = self.index.get(student_id)
+            if row is None:
+                self.index[student_id] = len(self.sums)
+                self.sums.append(other.sums[other_row])
+                self.counts.append(other.counts[other_row])
+            else:
+                self.sums[row] += other.sums[other_row]
+                self.counts[row] += other.counts[other_row]
+
+    def ids(self):
+        """Returns the student ids as an array, in the order of the rows of sums and counts"""
+        ids = array("q", bytes(8*len(self.index)))
+        for student_id, row in self.index.items():
+            ids[row] = student_id
+        return ids
+
+    @staticmethod
+    def fromColumns(ids, sums, counts):
+        """Makes a StudentAggregate from the columns of student ids, sums and counts"""
+        aggregate = StudentAggregate()
+        aggregate.index = dict(zip(ids, range(len(ids))))
+        aggregate.sums = array("d", sums)
+        aggregate.counts = array("q", counts)
+        return aggregate
+
+    def sketch(self, eps):
+        """Returns a QuantileSketch with rank error eps of the average score of each student"""
+        sketch = QuantileSketch(eps)
+        for s, c in zip(self.sums, self.counts):
+            sketch.add(s/c)
+        return sketch
+
+    def means(self, sort = True):
+        """Returns the list of the average score of each student, sorted unless sort is False"""
+        output = [s/c for s, c in zip(self.sums, self.counts)]
+        if sort:
+            output.sort()
+        return output
+
+
+class Stats(object):
+    """Records where the time of a run goes. Each stage (such as "read", "parse" or "select") adds up its wall clock and CPU time over all the times it ran, and the number of rows read and matched is kept for each file. Pass a Stats to getData, getAllData or makeECDF to fill it in.
+    A hook is a function hook(stage, wall, cpu) that is called every time a stage ends. Stages that ran in worker processes are reported to the hooks when their results come back"""
+
+    __slots__ = ("stages", "files", "counters", "hooks")
+
+    def __init__(self):
+        self.stages = {}
+        self.files = {}
+        self.counters = {}
+        self.hooks = []
+
+    def addHook(self, hook):
+        self.hooks.append(hook)
+
+    @contextmanager
+    def stage(self, name):
+        """Times the code in a with block as the stage name"""
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def record(self, name, wall, cpu, calls = 1):
+        totals = self.stages.setdefault(name, [0.0, 0.0, 0])
+        totals[0] += wall
+        totals[1] += cpu
+        totals[2] += calls
+        for hook in self.hooks:
+            hook(name, wall, cpu)
+
+    def countRows(self, this_file, rows = 0, matched = 0):
+        """Adds to the number of rows read from a file, and the number of them that were kept"""
+        counts = self.files.setdefault(this_file, {"rows": 0, "matched": 0})
+        counts["rows"] += rows
+        counts["matched"] += matched
+
+    def merge(self, other):
+        """Adds the records of another Stats, such as the one of a worker process"""
+        for name, (wall, cpu, calls) in other.stages.items():
+            self.record(name, wall, cpu, calls)
+        for this_file, counts in other.files.items():
+            self.countRows(this_file, counts["rows"], counts["matched"])
+        self.counters.update(other.counters)
+
+    def report(self):
+        """Returns everything that was recorded as a dictionary, ready to be saved as JSON"""
+        peak = None
+        if resource is not None:
+            peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+            #Linux reports kilobytes and macOS bytes
+            peak = peak / (1024.0*1024.0) if sys.platform == "darwin" else peak / 1024.0
+        stages = dict((name, {"wall": wall, "cpu": cpu, "calls": calls}) for name, (wall, cpu, calls) in self.stages.items())
+        report = {"stages": stages, "files": self.files, "peak_rss_mb": peak}
+        report.update(self.counters)
+        return report
+
+    def printReport(self, out = None):
+        """Writes the report as a table, to the standard error unless out is given"""
+        out = sys.stderr if out is None else out
+        report = self.report()
+        out.write("stage\twall_seconds\tcpu_seconds\tcalls\n")
+        for name in sorted(report["stages"], key = lambda name: -report["stages"][name]["wall"]):
+            stage = report["stages"][name]
+            out.write("%s\t%.4f\t%.4f\t%d\n" % (name, stage["wall"], stage["cpu"], stage["calls"]))
+        out.write("\nfile\trows\tmatched\n")
+        for this_file in sorted(report["files"]):
+            out.write("%s\t%d\t%d\n" % (this_file, report["files"][this_file]["rows"], report["files"][this_file]["matched"]))
+        out.write("\n")
+        for name in sorted(self.counters):
+            out.write("%s\t%s\n" % (name, self.counters[name]))
+        if report["peak_rss_mb"] is not None:
+            out.write("peak_rss_mb\t%.1f\n" % report["peak_rss_mb"])
+
+
+class RowFilter(object):
+    """Selects lines by course and test date, on top of the school. course is the name of a course, and start and end are dates in the YYYY-MM-DD form of the files, or the start of one such as 2015-03 for a whole month. Both ends are included, so RowFilter(start = "2015-03", end = "2015-05") keeps the spring of 2015. A field left as None does not filter.
+    The filter compares the text of the fields as they are in the file. The readers still convert and check the student id and score of every line they parse, whether the filter keeps it or not, so a filter does not change which files are rejected"""
+
+    __slots__ = ("course", "start", "end", "quote")
+
+    DATE = re.compile(r"\d{4}(-\d{2}(-\d{2})?)?$")
+
+    def __init__(self, course = None, start = None, end = None):
+        if course is not None and not isinstance(course, str):
+            raise InvalidArgumentError("The course must be a string")
+        for date in [start, end]:
+            if date is not None and (not isinstance(date, str) or not self.DATE.match(date)):
+                raise InvalidArgumentError("Dates must have the form 2015-03-17, 2015-03 or 2015")
+        if start is not None and end is not None and start[:len(end)] > end:
+            raise InvalidArgumentError("The start date "+start+" is after the end date "+end)
+        self.course = course
+        self.start = start
+        self.end = end
+        self.quote = '"'
+
+    def encode(self, encoding):
+        """Returns the same filter for fields that are bytes in the given encoding"""
+        encoded = RowFilter()
+        encoded.course, encoded.start, encoded.end = [None if value is None else value.encode(encoding) for value in [self.course, self.start, self.end]]
+        encoded.quote = b'"'
+        return encoded
+
+    def matches(self, course, date):
+        """Checks the course and test_date fields of a line, as they are in the file"""
+        return self.matchesCourse(course) and self.matchesDate(date)
+
+    def matchesCourse(self, course):
+        return self.course is None or course.strip(self.quote) == self.course
+
+    def matchesDate(self, date):
+        if self.start is None and self.end is None:
+            return True
+        date = date.strip().strip(self.quote)
+        if self.start is not None and date < self.start:
+            return False
+        return self.end is None or date[:len(self.end)] <= self.end
+
+    def mayMatch(self, course, month):
+        """Checks whether lines of a course in a month (the first 7 characters of their dates) may match. Used with the keys of a FileIndex"""
+        if self.course is not None and course != self.course:
+            return False
+        if self.start is not None and month < self.start[:7]:
+            return False
+        return self.end is None or month[:len(self.end)] <= self.end[:7]
+
+
+def parseArg(argv, need_files = True):
+    """Parses the command line arguments. Checks for errors and returns a tuple (school, [files, to, search]). The school is None when --all-schools was asked for. With need_files = False the list of files may be empty"""
 
     if not isinstance(argv, list): 
         """Check to make sure argv is a list"""
         raise InvalidArgumentError('Must pass a list to parseArg.')
 
-    if(len(argv)<4):
+    least = 1 if need_files else 0
+    if(len(argv)>=2+least and argv[1] == "--all-schools"):
+        """The arguments ['ecdf.py', '--all-schools', input_file1.csv] ask for the ECDF of every school. We signal this by returning None as the school"""
+        return (None, argv[2:])
+
+    if(len(argv)<3+least):
         """All arguments must have the form ['ecdf.py', '--school', '"name_of_university"', input_file1.csv]"""
         raise InvalidArgumentError("""This program must be run with the following format: \npython ecdf.py --school "Port Chester University" file1.csv file2.csv""")
     
@@ -45,138 +363,2350 @@ def parseArg(argv):
 
 
 
-def getData(university, files):
-    """This function will open and read the files supplied and then average the grades of each students from the supplied university. The output will be a sorted list of average test scores, one for each student"""
+#The parsers that getData can use to read the csv files
+ENGINES = ("python", "numpy")
 
-    if not isinstance(files, list): 
-        """Check to make sure files is a list"""
+#The numpy engine and snapshots store student ids as int64. The python engine takes any integer
+ID_LIMIT = "A student_id does not fit in 64 bits, which the numpy engine and snapshots need; use the python engine."
+
+def _quantileList(text):
+    """Turns the value of --quantiles, such as 0.1,0.5,0.9, into a list of floats. Raises ValueError if it is not a list of numbers"""
+
+    return [float(q) for q in text.split(",")]
+
+#The optional arguments understood by parseOptions, and the type of the value each one takes
+#Options that take no value are marked with None
+OPTIONS = {"--jobs": int, "--engine": str, "--approx": float, "--cache-dir": str, "--cache-size": int, "--cache": None, "--no-cache": None, "--clear-cache": None, "--snapshot": str,
+           "--format": str, "--output": str, "--host": str, "--port": int, "--socket": str, "--poll": float,
+           "--stats": None, "--stats-json": str, "--strict": None,
+           "--course": str, "--from": str, "--to": str, "--index": None,
+           "--method": str, "--quantiles": _quantileList, "--batch": str}
+
+def parseOptions(argv, table = OPTIONS):
+    """Removes the optional arguments (such as --jobs 4) from the command line arguments. Returns a tuple ({option: value}, [remaining, arguments]), where the remaining arguments can then be handed to parseArg. The options understood are the keys of table"""
+
+    if not isinstance(argv, list): 
+        """Check to make sure argv is a list"""
+        raise InvalidArgumentError('Must pass a list to parseOptions.')
+
+    options = {}
+    remaining = argv[:1]
+    i = 1
+    while i < len(argv):
+        if argv[i] not in table:
+            remaining.append(argv[i])
+            i += 1
+            continue
+
+        name = argv[i][2:].replace("-", "_")
+        if table[argv[i]] is None:
+            options[name] = True
+            i += 1
+            continue
+        if i+1 >= len(argv):
+            raise InvalidArgumentError("The option "+argv[i]+" needs a value.")
+        try:
+            options[name] = table[argv[i]](argv[i+1])
+        except ValueError:
+            raise InvalidArgumentError("The value of "+argv[i]+" is not valid: "+argv[i+1])
+        i += 2
+
+    return (options, remaining)
+
+
+def getData(university, files, jobs = 1, engine = "python", sort = True, cache = None, stats = None, strict = True, where = None, index = None):
+    """This function will open and read the files supplied and then average the grades of each students from the supplied university. The output will be a sorted list of average test scores, one for each student. With jobs > 1 the files are read by that many worker processes, and engine selects the parser (one of ENGINES). With sort = False the list is left unsorted, for makeECDF(data, presorted = False). If a ParseCache is given, the files are read from it when they have been parsed before, and if a Stats is given the time of each stage is recorded in it.
+    Every line is parsed and checked unless strict = False. Then, without a cache, the python engine only parses the lines that contain the name of the university (see _readFilePrefiltered), which is much faster when the university has a small share of the lines, but malformed lines of other schools go unnoticed.
+    A RowFilter given as where keeps only the lines of a course or a range of dates. If a FileIndex is given and strict is False, it is used instead of the cache, and only the parts of the files that may hold the lines asked for are read. Lines in the parts that are skipped are not checked"""
+
+    if not isinstance(university, str): 
+        """Check to make sure university is a string"""
         raise InvalidArgumentError('Format should be getData("ABC University", ["file1.csv", "file2.csv"]')
 
+    _checkFiles(files)
+    _checkJobs(jobs)
+    _checkEngine(engine)
+
+    _checkWhere(where)
+    data = _readFiles(files, university, jobs, engine, cache, stats = stats, strict = strict, where = where, index = index)[university]
+
+    if(len(data) == 0):
+        raise FileError ("Did not find any data for "+university)
+
+    if stats is None:
+        return data.means(sort)
+    stats.counters["students"] = len(data)
+    with stats.stage("average"):
+        return data.means(sort)
+
+
+def getAllData(files, jobs = 1, engine = "python", sort = True, cache = None, stats = None, where = None, index = None, strict = True):
+    """This function reads the files supplied only once and averages the grades of every student at every school it finds. The output is a dictionary mapping each school name to the sorted list of average test scores of its students, so that getAllData(files)[school] == getData(school, files). As in getData, a FileIndex is only used with strict = False"""
+
+    _checkFiles(files)
+    _checkJobs(jobs)
+    _checkEngine(engine)
+    _checkWhere(where)
+
+    data = _readFiles(files, None, jobs, engine, cache, stats = stats, strict = strict, where = where, index = index)
+
+    if(len(data) == 0):
+        raise FileError ("Did not find any data in the files supplied")
+
+    if stats is None:
+        return dict((school, data[school].means(sort)) for school in data)
+    stats.counters["schools"] = len(data)
+    stats.counters["students"] = sum([len(data[school]) for school in data])
+    with stats.stage("average"):
+        return dict((school, data[school].means(sort)) for school in data)
+
+
+def getSketch(university, files, eps, jobs = 1, engine = "python", cache = None, stats = None, strict = True, where = None, index = None):
+    """Does the same as getData, but the average test scores are fed into a QuantileSketch with rank error eps instead of being returned as a list. Pass the sketch to approxECDF to get the percentiles"""
+
     if not isinstance(university, str): 
         """Check to make sure university is a string"""
+        raise InvalidArgumentError('Format should be getSketch("ABC University", ["file1.csv", "file2.csv"], 0.01)')
+
+    _checkFiles(files)
+    _checkJobs(jobs)
+    _checkEngine(engine)
+    _checkEps(eps)
+
+    _checkWhere(where)
+    data = _readFiles(files, university, jobs, engine, cache, stats = stats, strict = strict, where = where, index = index)[university]
+
+    if(len(data) == 0):
+        raise FileError ("Did not find any data for "+university)
+
+    if stats is None:
+        return data.sketch(eps)
+    stats.counters["students"] = len(data)
+    with stats.stage("sketch"):
+        return data.sketch(eps)
+
+
+def getAllSketches(files, eps, jobs = 1, engine = "python", cache = None, stats = None, where = None, index = None, strict = True):
+    """Does the same as getAllData, but returns a dictionary mapping each school name to a QuantileSketch of the average test scores of its students"""
+
+    _checkFiles(files)
+    _checkJobs(jobs)
+    _checkEngine(engine)
+    _checkEps(eps)
+
+    _checkWhere(where)
+    data = _readFiles(files, None, jobs, engine, cache, stats = stats, strict = strict, where = where, index = index)
+
+    if(len(data) == 0):
+        raise FileError ("Did not find any data in the files supplied")
+
+    if stats is None:
+        return dict((school, data[school].sketch(eps)) for school in data)
+    stats.counters["schools"] = len(data)
+    stats.counters["students"] = sum([len(data[school]) for school in data])
+    with stats.stage("sketch"):
+        return dict((school, data[school].sketch(eps)) for school in data)
+
+
+def _checkFiles(files):
+    """Checks that files is a list of names of .csv files, which may be compressed"""
+
+    if not isinstance(files, list): 
+        """Check to make sure files is a list"""
         raise InvalidArgumentError('Format should be getData("ABC University", ["file1.csv", "file2.csv"]')
-        
+
     if not all([isinstance(f, str) for f in files]):
         """Check to make sure that all the files are strings"""
         raise InvalidArgumentError('Format should be getData("ABC University", ["file1.csv", "file2.csv"]')
 
-    if not all([f[-4:] == ".csv" for f in files]):
+    if not all([f[-4:] == ".csv" or _compression(f) is not None for f in files]):
         """Check to make sure that all the files are in .csv format"""
-        raise FileError('This program requires all files to have a .csv extension')
+        raise FileError('This program requires all files to have a .csv, .csv.gz, .csv.bz2 or .csv.xz extension')
+
+    for f in files:
+        if _compression(f) is not None and COMPRESSIONS[_compression(f)] is None:
+            raise FileError("This Python was built without the module needed to read "+f)
+
+
+def _checkJobs(jobs):
+    """Checks that the number of worker processes is a positive integer"""
+
+    if not isinstance(jobs, int) or isinstance(jobs, bool) or jobs < 1:
+        raise InvalidArgumentError("The number of jobs must be a positive integer")
+
+
+def _checkEngine(engine):
+    """Checks that the engine is one we know, and that NumPy is available if it is needed"""
+
+    if engine not in ENGINES:
+        raise InvalidArgumentError("The engine must be one of: "+", ".join(ENGINES))
+
+    if engine == "numpy" and np is None:
+        raise InvalidArgumentError("The numpy engine requires NumPy to be installed")
+
+
+def _checkEps(eps):
+    """Checks that the rank error of a QuantileSketch is a float between 0 and 1"""
+
+    if not isinstance(eps, float) or not 0 < eps < 1:
+        raise InvalidArgumentError("The rank error of the sketch must be a float between 0 and 1")
+
+
+def _checkWhere(where):
+    """Checks that where is a RowFilter, or None"""
+
+    if where is not None and not isinstance(where, RowFilter):
+        raise InvalidArgumentError("where must be a RowFilter")
+
 
-    #We will temporarily put the student test scores in a dictionary
-    data = {}
+def _readFiles(files, university = None, jobs = 1, engine = "python", cache = None, data = None, stats = None, strict = True, where = None, index = None):
+    """Reads every line of every file once and collects the test scores of each student, grouped by school. If university is given, only the scores of that school are kept. The output is a dictionary {school: StudentAggregate}. If data is given, the scores are added to the aggregates already in it. If stats is given, the stages of the reading are recorded in it.
+    With strict = False, the python engine only parses the lines that may belong to university, and with a FileIndex only the blocks of the files that may match are read. Only the lines that match the RowFilter where are kept"""
 
-    #Below is the code to open and read the csv files
-    for this_file in files:
+    if data is None:
+        data = {}
+    if university is not None and university not in data:
+        data[university] = StudentAggregate()
+
+    #Every score is added to one running sum per student, in the order of the files and of their lines.
+    #Float addition is not associative, so adding up the totals of each file would change the last digits of the averages.
+    #Worker processes therefore only parse the files, and send back the scores they kept for the parent to add up in order
+    #The numpy engine adds up into one _ArrayGroup per school, which becomes a StudentAggregate again once all the files are read
+    read = partial(_readInto, university = university, engine = engine, cache = cache, strict = strict, where = where, index = index)
+    try:
+        if jobs > 1 and len(files) > 1:
+            pool = Pool(min(jobs, len(files)))
+            try:
+                for rows, part_stats in pool.imap(partial(_readRows, read), files):
+                    if stats is None:
+                        _addRows(data, rows, engine)
+                        continue
+                    stats.merge(part_stats)
+                    with stats.stage("merge"):
+                        _addRows(data, rows, engine)
+            finally:
+                pool.terminate()
+        elif stats is None:
+            for this_file in files:
+                read(this_file, data, None)
+        else:
+            for this_file in files:
+                matched = _countScores(data)
+                read(this_file, data, stats)
+                stats.countRows(this_file, matched = _countScores(data) - matched)
+    finally:
+        if stats is None:
+            _toAggregates(data)
+        else:
+            with stats.stage("aggregate"):
+                _toAggregates(data)
+
+    return data
+
+
+def _readInto(this_file, data, stats, kind = StudentAggregate, university = None, engine = "python", cache = None, strict = True, where = None, index = None):
+    """Reads one file with the reader that the arguments of _readFiles ask for, and adds its scores to data: to StudentAggregates, or to _ScoreRows in a worker process (kind = _ScoreRows)"""
+
+    if strict:
+        #The index skips lines without checking them, so a strict read parses the whole file
+        index = None
+    if engine == "python" and index is not None:
+        return index.readFile(this_file, university, where, stats, data, kind)
+    if engine == "python" and cache is None:
+        if university is not None and not strict:
+            return _readFilePrefiltered(this_file, university, stats, where, data, kind)
+        return _readFile(this_file, university, stats, where, data, kind)
+
+    if stats is None:
+        stats = Stats()
+    if index is not None:
+        return index.readRows(this_file, university, where, stats, data, kind)
+    if cache is None:
+        return _readFileNumpy(this_file, university, stats, where, data, kind)
+
+    columns = cache.columns(this_file, stats, engine)
+    with stats.stage("aggregate"):
+        rows = columns.select(university, where)
+    if kind is _ScoreRows:
+        data.update(rows)
+        return data
+    with stats.stage("aggregate"):
+        return _addRows(data, rows, engine)
+
+
+def _readRows(read, this_file):
+    """Reads a file in a worker process with read (a partial _readInto). Returns ({school: _ScoreRows}, Stats), so that the scores and the Stats of the worker get back to the parent"""
+
+    stats = Stats()
+    rows = read(this_file, {}, stats, _ScoreRows)
+    stats.countRows(this_file, matched = sum([len(part) for part in rows.values()]))
+    return rows, stats
+
+
+def _countScores(data):
+    """Returns the number of scores added up in the aggregates of data"""
+
+    return sum([int(aggregate.counts.sum()) if isinstance(aggregate, _ArrayGroup) else sum(aggregate.counts) for aggregate in data.values()])
+
+
+class _ScoreRows(object):
+    """The scores of the students of one school read from one file, in the order of the file. ids and scores are lists or arrays, or NumPy arrays. They are what a worker process sends back instead of a StudentAggregate, and what the numpy engine and the ParseCache add up"""
+
+    __slots__ = ("ids", "scores")
+
+    def __init__(self, ids = None, scores = None):
+        self.ids = [] if ids is None else ids
+        self.scores = array("d") if scores is None else scores
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, student_id, score):
+        self.ids.append(student_id)
+        self.scores.append(score)
+
+
+def _addRows(data, rows, engine = "python"):
+    """Adds the scores of {school: _ScoreRows} to the aggregates of data, one at a time in their order. The numpy engine adds them to the running _ArrayGroup of each school with a vectorized group-by"""
+
+    for school, part in rows.items():
+        if engine == "numpy":
+            try:
+                ids = np.asarray(part.ids, dtype=np.int64)
+            except OverflowError:
+                raise FileError(ID_LIMIT)
+            _arrayGroup(data, school).add(ids, np.asarray(part.scores, dtype=np.float64))
+            continue
+
+        aggregate = data.get(school)
+        if aggregate is None:
+            aggregate = data[school] = StudentAggregate()
+        ids, scores = part.ids, part.scores
+        if np is not None and isinstance(ids, np.ndarray):
+            ids, scores = ids.tolist(), scores.tolist()
+        for student_id, score in zip(ids, scores):
+            aggregate.add(student_id, score)
+    return data
+
+
+def _arrayGroup(data, school):
+    """Returns the running _ArrayGroup of a school in data, starting it from the StudentAggregate of the school if there is one"""
+
+    group = data.get(school)
+    if not isinstance(group, _ArrayGroup):
+        group = data[school] = _ArrayGroup(group)
+    return group
+
+
+def _toAggregates(data):
+    """Turns the running _ArrayGroups in data back into StudentAggregates"""
+
+    for school, group in data.items():
+        if isinstance(group, _ArrayGroup):
+            data[school] = group.toAggregate()
+    return data
+
+
+def _mergeInto(data, part):
+    """Merges the aggregates {school: StudentAggregate} of part into data, adding up the sums of the students found in both"""
+
+    for school, aggregate in part.items():
+        if school in data and len(data[school]) > 0:
+            data[school].merge(aggregate)
+        else:
+            data[school] = aggregate
+
+
+#Makes a decompressor for each kind of compressed csv file, or None if Python was built without its module
+COMPRESSIONS = {".csv.gz": None if zlib is None else partial(zlib.decompressobj, 16 + zlib.MAX_WBITS),
+                ".csv.bz2": None if bz2 is None else bz2.BZ2Decompressor,
+                ".csv.xz": None if lzma is None else lzma.LZMADecompressor}
+
+#Compressed files are read in blocks of this many bytes and decompressed ahead of the parser, keeping at most READ_AHEAD blocks waiting
+READ_AHEAD_SIZE = 1 << 18
+READ_AHEAD = 4
+
+def _compression(this_file):
+    """Returns the suffix of a compressed csv file, such as ".csv.gz", or None if the file is not compressed"""
+
+    for suffix in COMPRESSIONS:
+        if this_file.endswith(suffix):
+            return suffix
+    return None
+
+
+def _openFile(this_file, binary = False, digest = None):
+    """Opens a csv file for reading, as text unless binary is True. A compressed file is decompressed as it is read, by a _ReadAhead thread. If a hashlib digest is given, the bytes of the file are added to it as they are read"""
+
+    suffix = _compression(this_file)
+    if suffix is None and digest is None:
+        return open(this_file, "rb" if binary else "r")
+    raw = open(this_file, "rb", buffering = 0)
+    if digest is not None:
+        raw = _Hashing(raw, digest)
+    if suffix is None:
+        f = io.BufferedReader(raw, 1 << 20)
+    else:
+        f = io.BufferedReader(_ReadAhead(raw, this_file, COMPRESSIONS[suffix]), 1 << 20)
+    if binary:
+        return f
+    #open() decodes with the same encoding
+    return io.TextIOWrapper(f, encoding = locale.getpreferredencoding(False))
+
+
+class _Hashing(io.RawIOBase):
+    """Reads a raw file and adds the bytes read to a hashlib digest, so that a file can be hashed in the same pass that parses it"""
+
+    def __init__(self, raw, digest):
+        io.RawIOBase.__init__(self)
+        self.raw = raw
+        self.digest = digest
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.raw.readinto(b)
+        if n:
+            self.digest.update(memoryview(b)[:n])
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+        io.RawIOBase.close(self)
+
+
+class _ReadAhead(io.RawIOBase):
+    """Decompresses a file on a background thread, so that decompression overlaps with parsing. Each block of the file is decompressed with a single call, during which zlib, bz2 and lzma release the GIL. Files made of several compressed streams one after the other (as made by cat a.gz b.gz) are read to the end.
+    Errors of the decompressor are raised in the reading thread as a FileError naming the file"""
+
+    def __init__(self, raw, name, decompressor):
+        io.RawIOBase.__init__(self)
+        self.raw = raw
+        self.name = name
+        self.decompressor = decompressor
+        self.blocks = queue.Queue(READ_AHEAD)
+        self.block = memoryview(b"")
+        self.done = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target = self._fill)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _fill(self):
         try:
-            f = open(this_file)
+            decompressor = self.decompressor()
+            started = False
+            while not self.stopped.is_set():
+                data = self.raw.read(READ_AHEAD_SIZE)
+                if not data:
+                    if started and not decompressor.eof:
+                        raise EOFError("the file ended before the end of the compressed data")
+                    self._put(b"")
+                    return
+                while data:
+                    started = True
+                    block = decompressor.decompress(data)
+                    if block:
+                        self._put(block)
+                    data = b""
+                    if decompressor.eof:
+                        #Another stream may follow this one
+                        data = decompressor.unused_data
+                        decompressor = self.decompressor()
+                        started = False
+        except Exception as e:
+            self._put(e)
 
-            #if the file did not open, an exception will be raised, and the following code will not run.
-            #Assuming the file did open, there still may be problems with the data in the csv file
-            #And much of the following code checks for that
-            error_string = "The file "+str(this_file)+" is not formatted in the correct format."
-            for line in f:
-                data_line = line.strip().split(",")
-                if(len(data_line) != 5):
-                    raise FileError(error_string+" Length != 5")
-                try:
-                    student_id = int(data_line[0])
-                    score = float(data_line[4])
-                except ValueError:
-                    raise FileError(error_string+" student_id or score not numeric")
-                
-                #The following lines have been commented out, 
-                #because requiring that the school name have quotes seemed too restrictive
-                #
-                #if((data_line[2][0] != '"') or (data_line[2][-1] != '"')):
-                #    raise FileError(error_string+" The school name is not surrounded by quotes as defined in the API")
-                
-                #Now that we have checked that the data is in the correct form
-                #We are ready to parse it, and collect the data for each student
-                school = data_line[2].strip('"')
-                if(school == university):
+    def _put(self, item):
+        #The reader may stop early, so we never wait on a full queue for good
+        while not self.stopped.is_set():
+            try:
+                self.blocks.put(item, timeout = 0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self.block:
+            if self.done:
+                return 0
+            item = self.blocks.get()
+            if isinstance(item, Exception):
+                self.done = True
+                raise FileError("Could not decompress "+str(self.name)+": "+str(item))
+            if not item:
+                self.done = True
+                return 0
+            self.block = memoryview(item)
+        n = min(len(b), len(self.block))
+        b[:n] = self.block[:n]
+        self.block = self.block[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            self.thread.join()
+            self.raw.close()
+        io.RawIOBase.close(self)
+
+
+#The python engine reads the lines of a file in batches of about this many bytes
+READ_SIZE = 1 << 20
+
+def _readFile(this_file, university = None, stats = None, where = None, data = None, kind = StudentAggregate):
+    """Reads one file and adds its scores to the aggregates {school: StudentAggregate} of data, which are returned. If university is given, only the scores of that school are kept, and if where is given only the lines it matches. Raises a FileError naming the file if it cannot be read or is malformed.
+    The lines are read in batches, so that the time spent reading the file ("read") and parsing and adding up its lines ("parse") can be recorded in stats. New schools get a kind() to add their scores to, such as the _ScoreRows of a worker process"""
+
+    if stats is None:
+        stats = Stats()
+
+    #We keep a running sum and count of the test scores of each student of each school
+    if data is None:
+        data = {}
+    try:
+        f = _openFile(this_file)
+
+        #if the file did not open, an exception will be raised, and the following code will not run.
+        #Assuming the file did open, there still may be problems with the data in the csv file
+        #And much of the following code checks for that
+        error_string = "The file "+str(this_file)+" is not formatted in the correct format."
+        while True:
+            with stats.stage("read"):
+                lines = f.readlines(READ_SIZE)
+            if not lines:
+                break
+            stats.countRows(this_file, len(lines))
+
+            with stats.stage("parse"):
+                _addLines(lines, university, where, data, error_string, kind)
+
+    #We catch the raised errors
+    except FileError as e:
+        f.close()
+        raise(e)  
+          
+    except IOError:
+        error_string = "Could not open "+ str(this_file)+". Check that the path is correct."
+        raise FileError (error_string)
+
+    else:
+        f.close()
+
+    return data
+
+
+def _addLines(lines, university, where, data, error_string, kind = StudentAggregate):
+    """Parses and checks lines of text, and adds the scores of the ones that are kept to the aggregates in data"""
+
+    for line in lines:
+        data_line = line.strip().split(",")
+        if(len(data_line) != 5):
+            raise FileError(error_string+" Length != 5")
+        try:
+            student_id = int(data_line[0])
+            score = float(data_line[4])
+        except ValueError:
+            raise FileError(error_string+" student_id or score not numeric")
+        
+        #The following lines have been commented out, 
+        #because requiring that the school name have quotes seemed too restrictive
+        #
+        #if((data_line[2][0] != '"') or (data_line[2][-1] != '"')):
+        #    raise FileError(error_string+" The school name is not surrounded by quotes as defined in the API")
+        
+        #Now that we have checked that the data is in the correct form
+        #We are ready to parse it, and collect the data for each student
+        school = data_line[2].strip('"')
+        if(university is None or school == university):
+            if where is not None and not where.matches(data_line[1], data_line[3]):
+                continue
+            aggregate = data.get(school)
+            if aggregate is None:
+                aggregate = data[school] = kind()
+            aggregate.add(student_id, score)
+
+
+def _readFilePrefiltered(this_file, university, stats = None, where = None, data = None, kind = StudentAggregate):
+    """Does the same as _readFile for one university, without looking at most lines. The file is memory-mapped and searched for the encoded name of the university, and only the lines where it is found (quoted or not, in any field) are parsed and checked. Every line of the university contains its name, so the scores are the same, and they are added in the same order.
+    The course and date of the lines found are checked against where before their numbers are converted. Compressed files cannot be memory-mapped, so they are read with _readFile. If stats is given, the lines of the whole file are counted as the rows read, which takes one more pass over the mapped file"""
+
+    if _compression(this_file) is not None:
+        return _readFile(this_file, university, stats, where, data, kind)
+    count_rows = stats is not None
+    if stats is None:
+        stats = Stats()
+
+    if data is None:
+        data = {}
+    try:
+        f = open(this_file, "rb")
+    except IOError:
+        error_string = "Could not open "+ str(this_file)+". Check that the path is correct."
+        raise FileError (error_string)
+
+    #Python would decode the file with this encoding in _readFile, so the name is encoded the same way
+    encoding = locale.getpreferredencoding(False)
+    target = university.encode(encoding)
+    if where is not None:
+        where = where.encode(encoding)
+    error_string = "The file "+str(this_file)+" is not formatted in the correct format."
+    try:
+        with stats.stage("read"):
+            size = os.fstat(f.fileno()).st_size
+            if size == 0 or not target:
+                return data
+            mapped = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        try:
+            with stats.stage("parse"):
+                aggregate = data.get(university)
+                found = mapped.find(target)
+                while found >= 0:
+                    start = mapped.rfind(b"\n", 0, found) + 1
+                    end = mapped.find(b"\n", found)
+                    if end < 0:
+                        end = size
+
+                    #int and float take bytes, so the line does not have to be decoded
+                    data_line = mapped[start:end].strip().split(b",")
+                    if(len(data_line) != 5):
+                        raise FileError(error_string+" Length != 5")
+                    if where is not None and not where.matches(data_line[1], data_line[3]):
+                        found = mapped.find(target, end)
+                        continue
                     try:
-                        data[student_id].append(score)
-                    except KeyError:
-                        data[student_id] = [score]
+                        student_id = int(data_line[0])
+                        score = float(data_line[4])
+                    except ValueError:
+                        raise FileError(error_string+" student_id or score not numeric")
 
-        #We catch the raised errors
-        except FileError as e:
-            f.close()
-            raise(e)  
-              
-        except IOError:
-            error_string = "Could not open "+ str(this_file)+". Check that the path is correct."
-            raise FileError (error_string)
+                    #The name may also have been found in another field, or inside a longer name
+                    if data_line[2].strip(b'"') == target:
+                        if aggregate is None:
+                            aggregate = data[university] = kind()
+                        aggregate.add(student_id, score)
+                    found = mapped.find(target, end)
+            if count_rows:
+                with stats.stage("read"):
+                    #mmap has no count, so the newlines are counted in slices of the file
+                    lines = sum([mapped[offset:offset + READ_SIZE].count(b"\n") for offset in range(0, size, READ_SIZE)])
+                    stats.countRows(this_file, lines + (mapped[size - 1:size] != b"\n"))
+        finally:
+            mapped.close()
+    finally:
+        f.close()
 
-        else:
-            f.close()
+    return data
 
-    if(len(data) == 0):
-        raise FileError ("Did not find any data for "+university)
 
+#The numpy engine reads the files in chunks of about this many bytes
+CHUNK_SIZE = 1 << 22
 
-    #Now that we have all of the student data, we will want to get the average for each student
-    output = []  
-    for student in data:
-        output.append(sum(data[student])/len(data[student]))
+def _readFileNumpy(this_file, university = None, stats = None, where = None, data = None, kind = StudentAggregate):
+    """Does the same as _readFile, but the file is read in chunks of CHUNK_SIZE bytes and each chunk is parsed with a few vectorized NumPy calls: student_id as int64, score as float64 and the school name as a categorical code. The lines are checked with the same rules as _readFile. The scores of each chunk are added to the running _ArrayGroup of each school in data with a vectorized group-by, or, in a worker process (kind = _ScoreRows), kept as _ScoreRows of NumPy arrays in the order of the file"""
 
-    #Finally, we return the sorted data
-    return sorted(output)
+    if data is None:
+        data = {}
+    if stats is None:
+        stats = Stats()
+    error_string = "The file "+str(this_file)+" is not formatted in the correct format."
+    try:
+        f = _openFile(this_file, binary = True)
+    except IOError:
+        error_string = "Could not open "+ str(this_file)+". Check that the path is correct."
+        raise FileError (error_string)
 
+    #Python would decode the file with this encoding in _readFile, so the school names are encoded the same way
+    encoding = locale.getpreferredencoding(False)
+    target = None if university is None else university.encode(encoding)
+    if where is not None:
+        where = where.encode(encoding)
+    groups = _ChunkGroups(data, kind, encoding)
+    try:
+        for chunk in _chunks(f, stats):
+            _parseChunk(chunk, target, groups, error_string, stats, this_file, where)
+    finally:
+        f.close()
 
-def makeECDF(data):
-    """This function will take the average test scores made by getData and calculate the 100 percentiles without interpolation. It will the output an array of 100 floats that correspond to the percentiles"""
+    return groups.finish()
 
-    if not isinstance(data, list): 
-        """Check to make sure data is a list"""
-        raise InvalidArgumentError("makeECDF only accepts lists")
-    
-    if sorted(data) != data:
-        """Checking to make sure the data is sorted"""
-        raise InvalidArgumentError("makeECDF accepts only sorted lists")
 
-    if len(data) == 0:
-        """There must be some data for us to run ECDF on"""
-        raise InvalidArgumentError("The length of the data was zero. There must be at least one data point.")
+def _chunks(f, stats = None):
+    """Reads a binary file in chunks of about CHUNK_SIZE bytes, and yields them cut at the end of their last complete line. The rest of the line starts the next chunk. The time spent reading is recorded in stats as the stage read"""
 
+    if stats is None:
+        stats = Stats()
+    rest = b""
+    while True:
+        with stats.stage("read"):
+            chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        chunk = rest + chunk
+        cut = chunk.rfind(b"\n") + 1
+        rest = chunk[cut:]
+        if cut > 0:
+            yield chunk[:cut]
+    #A last line without a newline is checked like any other, even if it is only spaces, as _readFile does
+    if rest:
+        yield rest + b"\n"
 
-    n = len(data)-1 #the negative one makes it match up with np.percentile
-    out = []
-    for i in range(100):
-        out.append(data[int(n*i/100)])
-    return out
 
-def printECDF(school, ecdf):
-    """This function will take the output of makeECDF and return a string that has been formatted to meet the requirements stipulated""" 
+def _parseChunk(chunk, target, groups, error_string, stats, this_file, where = None):
+    """Parses a chunk of complete lines and adds the scores of each school to groups (a _ChunkGroups). Only the school target (as bytes) is kept, unless target is None, and only the lines matched by where (a RowFilter of bytes)"""
 
-    if not isinstance(ecdf, list): 
-        """Check to make sure data is a list"""
-        raise InvalidArgumentError("printECDF needs a list")
-    
-    if sorted(ecdf) != ecdf:
-        """Checking to make sure the data is sorted"""
-        raise InvalidArgumentError("printECDF accepts only sorted lists")
+    with stats.stage("parse"):
+        student_ids, scores, schools, rows = _parseColumnsNumpy(chunk, error_string, where)
+    stats.countRows(this_file, rows)
 
-    if len(ecdf) != 100:
-        """The must be some data for us to run ECDF on"""
-        raise InvalidArgumentError("The length of the data was not 100.")
+    with stats.stage("aggregate"):
+        _groupChunk(student_ids, scores, schools, target, groups)
 
-    if not isinstance(school, str): 
-        """Check to make sure data is a list"""
-        raise InvalidArgumentError("printECDF needs the name of a school")
 
-    output = school+ " students\n\npercentile\tmean_test_score\n"
-    for i in range(100):
-        output = output+str(i+1)+'\t'+str(ecdf[i])+'\n'
+def _parseColumnsNumpy(chunk, error_string, where = None):
+    """Splits a chunk of complete lines into the arrays of student ids, scores and school names of the lines matched by where. Returns them with the number of lines in the chunk"""
 
-    return output
+    buf, starts, commas, ends = _chunkFields(chunk, error_string)
+    student_ids, scores = _chunkNumbers(buf, starts, commas, ends, error_string)
+    schools = np.char.strip(_fields(buf, commas[:, 1] + 1, commas[:, 2]), b'"')
+    if where is None:
+        return student_ids, scores, schools, len(ends)
+
+    selected = np.ones(len(ends), dtype=bool)
+    if where.course is not None:
+        selected &= np.char.strip(_fields(buf, commas[:, 0] + 1, commas[:, 1]), b'"') == where.course
+    if where.start is not None or where.end is not None:
+        dates = np.char.strip(np.char.strip(_fields(buf, commas[:, 2] + 1, commas[:, 3])), b'"')
+        if where.start is not None:
+            selected &= dates >= where.start
+        if where.end is not None:
+            #Casting to a shorter byte string cuts the dates to the length of end
+            selected &= dates.astype("S"+str(len(where.end))) <= where.end
+    return student_ids[selected], scores[selected], schools[selected], len(ends)
+
+
+def _chunkFields(chunk, error_string):
+    """Finds the lines of a chunk of complete lines and the 4 commas of each, checking that every line has 5 fields. Returns (buf, starts, commas, ends), where buf holds the bytes of the chunk padded for _fields"""
+
+    buf = np.frombuffer(chunk, dtype=np.uint8)
+    ends = np.flatnonzero(buf == ord("\n"))
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+
+    #Every line must have exactly 4 commas. If there are 4 commas per line on average,
+    #this is the case exactly when the first and last comma of each group of 4 fall on the same line
+    commas = np.flatnonzero(buf == ord(","))
+    if len(commas) != 4*len(ends):
+        raise FileError(error_string+" Length != 5")
+    commas = commas.reshape(-1, 4)
+    if (commas[:, 0] < starts).any() or (commas[:, 3] > ends).any():
+        raise FileError(error_string+" Length != 5")
+
+    #_fields reads a window as long as the longest line from each field, so we pad the end of the buffer
+    buf = np.concatenate((buf, np.zeros(int((ends - starts).max()) + 1, dtype=np.uint8)))
+    return buf, starts, commas, ends
+
+
+def _chunkNumbers(buf, starts, commas, ends, error_string):
+    """Converts the student ids and scores of the lines found by _chunkFields to arrays of int64 and float64"""
+
+    try:
+        student_ids = _fields(buf, starts, commas[:, 0]).astype(np.int64)
+        scores = _fields(buf, commas[:, 3] + 1, ends).astype(np.float64)
+    except ValueError:
+        raise FileError(error_string+" student_id or score not numeric")
+    except OverflowError:
+        raise FileError(error_string+" " + ID_LIMIT)
+    return student_ids, scores
+
+
+def _groupChunk(student_ids, scores, schools, target, groups):
+    """Adds the student ids and scores of a parsed chunk to groups (a _ChunkGroups), one school at a time"""
+
+    if target is not None:
+        selected = schools == target
+        if selected.any():
+            groups.add(target, student_ids[selected], scores[selected])
+        return
+
+    #The school names become categorical codes, and a stable sort keeps the lines of each school in their original order
+    names, codes = np.unique(schools, return_inverse=True)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))
+    for code, name in enumerate(names.tolist()):
+        rows = order[bounds[code]:bounds[code + 1]]
+        groups.add(name, student_ids[rows], scores[rows])
+
+
+class _ChunkGroups(object):
+    """Where the numpy engine puts the scores of each school of the chunks of a file. They are added to the running _ArrayGroup of the school in data as each chunk is parsed, so only one chunk of the file is held at a time. A worker process (kind = _ScoreRows) keeps the arrays instead, and finish joins them into the _ScoreRows of each school"""
+
+    __slots__ = ("data", "kind", "encoding", "parts")
+
+    def __init__(self, data, kind, encoding):
+        self.data = data
+        self.kind = kind
+        self.encoding = encoding
+        self.parts = {}
+
+    def add(self, name, student_ids, scores):
+        """Adds the arrays of one school, named as bytes, in a chunk"""
+        if self.kind is not _ScoreRows:
+            _arrayGroup(self.data, name.decode(self.encoding)).add(student_ids, scores)
+            return
+        ids, school_scores = self.parts.setdefault(name, ([], []))
+        ids.append(student_ids)
+        school_scores.append(scores)
+
+    def finish(self):
+        """Returns data, with the _ScoreRows of each school of a worker process"""
+        for name, (ids, scores) in self.parts.items():
+            self.data[name.decode(self.encoding)] = _ScoreRows(np.concatenate(ids), np.concatenate(scores))
+        return self.data
+
+
+def _fields(buf, starts, ends):
+    """Cuts the bytes buf[starts[i]:ends[i]] out of buf for every i, and returns them as an array of byte strings. buf must be padded so that a window of the widest field fits after every start"""
+
+    width = max(1, int((ends - starts).max()))
+    out = np.lib.stride_tricks.sliding_window_view(buf, width)[starts]
+    out[np.arange(width) >= (ends - starts)[:, None]] = 0
+    return out.view("S"+str(width)).ravel()
+
+
+class _ArrayGroup(object):
+    """The NumPy counterpart of StudentAggregate used by the numpy engine. The student ids are kept sorted so new scores can be matched to their student with searchsorted"""
+
+    __slots__ = ("ids", "sums", "counts")
+
+    def __init__(self, aggregate = None):
+        """Starts from the sums and counts of a StudentAggregate, if one is given"""
+        if aggregate is None or len(aggregate) == 0:
+            self.ids = np.empty(0, dtype=np.int64)
+            self.sums = np.empty(0, dtype=np.float64)
+            self.counts = np.empty(0, dtype=np.int64)
+            return
+        ids = np.frombuffer(aggregate.ids(), dtype=np.int64)
+        order = np.argsort(ids)
+        self.ids = ids[order]
+        self.sums = np.frombuffer(aggregate.sums, dtype=np.float64)[order]
+        self.counts = np.frombuffer(aggregate.counts, dtype=np.int64)[order]
+
+    def add(self, student_ids, scores):
+        """Adds the scores of a chunk. np.add.at adds them one at a time in the order of the file, so the sums are exactly the ones _readFile would make"""
+        rows = np.searchsorted(self.ids, student_ids)
+        missing = rows == len(self.ids)
+        missing[~missing] = self.ids[rows[~missing]] != student_ids[~missing]
+        if missing.any():
+            new_ids, first = np.unique(student_ids[missing], return_index = True)
+
+            #The new ids are sorted and not in self.ids yet, so inserting each one where searchsorted puts it keeps the ids sorted.
+            #As in StudentAggregate.add, a new student starts from its first score and not from 0.0, which would turn a score of -0.0 into 0.0
+            first = np.flatnonzero(missing)[first]
+            at = np.searchsorted(self.ids, new_ids)
+            self.ids = np.insert(self.ids, at, new_ids)
+            self.sums = np.insert(self.sums, at, scores[first])
+            self.counts = np.insert(self.counts, at, 1)
+            rest = np.ones(len(student_ids), dtype=bool)
+            rest[first] = False
+            student_ids, scores = student_ids[rest], scores[rest]
+            rows = np.searchsorted(self.ids, student_ids)
+
+        np.add.at(self.sums, rows, scores)
+        self.counts += np.bincount(rows, minlength=len(self.ids))
+
+    def toAggregate(self):
+        """Converts the group to a StudentAggregate"""
+        return StudentAggregate.fromColumns(self.ids.tolist(), self.sums.tolist(), self.counts.tolist())
+
+
+class _CacheDirectory(object):
+    """The files that ParseCache and FileIndex keep about csv files in a directory, one for each csv file, named after a hash of its path and ending with the SUFFIX of the class. After a file is written, the least recently used files of the directory, of both kinds, are deleted until they take at most max_size bytes"""
+
+    __slots__ = ("directory", "max_size")
+
+    SUFFIX = None
+
+    def __init__(self, directory = None, max_size = 1 << 30):
+        if directory is None:
+            directory = os.path.join(os.path.expanduser("~"), ".cache", "ecdf")
+        if not isinstance(directory, str) or not isinstance(max_size, int) or max_size < 0:
+            raise InvalidArgumentError(type(self).__name__+" needs a directory name and a size in bytes")
+        self.directory = directory
+        self.max_size = max_size
+
+    def _path(self, this_file):
+        return os.path.join(self.directory, hashlib.sha1(os.path.abspath(this_file).encode("utf-8")).hexdigest() + self.SUFFIX)
+
+    def _used(self, this_file):
+        """Records that the file kept about this_file was used. The modification time records when it was last used, which is what _evict goes by"""
+        try:
+            os.utime(self._path(this_file), None)
+        except OSError:
+            pass
+
+    def _write(self, this_file, write):
+        """Writes the file kept about this_file by calling write with it open in binary mode, then evicts the least recently used files if the directory is too big. The file is written under a temporary name and then renamed, so that a reader never sees half of it.
+        The files are only an optimization, so a directory we cannot write to is ignored"""
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+        except OSError:
+            return
+        path = self._path(this_file)
+        temporary = path + "." + str(os.getpid())
+        try:
+            f = open(temporary, "wb")
+            try:
+                write(f)
+            finally:
+                f.close()
+            os.replace(temporary, path)
+        except (IOError, OSError):
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            return
+        _evict(self.directory, self.max_size)
+
+    def clear(self):
+        """Deletes the files of this kind in the directory"""
+
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(self.SUFFIX):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+class ParseCache(_CacheDirectory):
+    """A cache of parsed csv files on disk. Each file is stored as a binary sidecar with one column per field: student ids as int64, scores as float64, and the school names, course names and test dates as int32 codes into a list of names. A sidecar is memory-mapped when it is read back, so a cached file costs a read of the columns instead of a parse of the text.
+    The sidecar of a file is found from its path, and is used if the size and modification time of the file are the ones stored in it. If only the modification time changed, the content hash of the file is compared before the sidecar is used. When the sidecars take more than max_size bytes, the least recently used ones are deleted"""
+
+    __slots__ = ()
+
+    #Bump the version whenever the layout of the sidecars changes
+    MAGIC = b"ECDFCACHE"
+    VERSION = 2
+    SUFFIX = ".ecdfcache"
+
+    def columns(self, this_file, stats, engine = "python"):
+        """Returns the _Columns of a file from the cache, parsing the file with the engine and caching it first if needed. The content hash stored with the columns is computed while the file is parsed"""
+
+        with stats.stage("cache"):
+            columns = self.load(this_file)
+        if columns is None:
+            digest = hashlib.sha1()
+            with stats.stage("parse"):
+                columns = _parseColumnsWith(this_file, engine, digest)
+            with stats.stage("cache"):
+                self.store(this_file, columns, digest.hexdigest())
+        stats.countRows(this_file, len(columns))
+        return columns
+
+    def load(self, this_file):
+        """Returns the cached _Columns of a file, or None if the file is not in the cache or has changed"""
+
+        try:
+            stat = os.stat(this_file)
+            f = open(self._path(this_file), "rb")
+        except (IOError, OSError):
+            return None
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            return None
+        finally:
+            f.close()
+
+        try:
+            header, offset = self._header(mapped)
+        except (ValueError, KeyError, TypeError, struct.error):
+            #A sidecar that is cut short or damaged is a miss, and is written again
+            return None
+        if header["size"] != stat.st_size:
+            return None
+        if header["mtime"] != stat.st_mtime_ns:
+            #The file was touched or copied. It can still be used if the content is the same
+            if header["hash"] != _contentHash(this_file):
+                return None
+            columns = _Columns.fromBuffer(mapped, offset, header)
+            self.store(this_file, columns, header["hash"])
+            return columns
+
+        self._used(this_file)
+        return _Columns.fromBuffer(mapped, offset, header)
+
+    def _header(self, mapped):
+        """Reads the header of a sidecar. Returns (header, offset of the first column), and raises ValueError, KeyError, TypeError or struct.error if the sidecar is not valid"""
+
+        start = len(self.MAGIC) + 8
+        if mapped[:len(self.MAGIC)] != self.MAGIC:
+            raise ValueError("not a sidecar")
+        length = struct.unpack("<Q", mapped[len(self.MAGIC):start])[0]
+        header = json.loads(mapped[start:start+length].decode("utf-8"))
+        if not isinstance(header, dict) or header.get("version") != self.VERSION:
+            raise ValueError("old sidecar")
+        for key, kind in [("size", int), ("mtime", int), ("hash", str), ("rows", int), ("schools", list), ("courses", list), ("dates", list)]:
+            if not isinstance(header[key], kind):
+                raise TypeError("bad sidecar header")
+        if header["rows"] < 0:
+            raise ValueError("bad sidecar header")
+        offset = _align(start + length)
+        if len(mapped) < offset + _Columns.byteSize(header["rows"]):
+            raise ValueError("truncated sidecar")
+        return header, offset
+
+    def store(self, this_file, columns, content_hash = None):
+        """Writes the sidecar of a file, then evicts the least recently used sidecars if the cache is too big. The content hash of the file is computed unless it is given"""
+
+        if isinstance(columns.ids, list):
+            #The student ids do not fit in the int64 column of a sidecar
+            return
+        try:
+            stat = os.stat(this_file)
+            if content_hash is None:
+                content_hash = _contentHash(this_file)
+            header = {"version": self.VERSION, "source": os.path.abspath(this_file), "size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": content_hash,
+                      "rows": len(columns), "schools": columns.school_names, "courses": columns.course_names, "dates": columns.date_names}
+            header = json.dumps(header).encode("utf-8")
+        except (IOError, OSError):
+            return
+        self._write(this_file, partial(self._writeSidecar, header, columns))
+
+    def _writeSidecar(self, header, columns, f):
+        """Writes a sidecar with its header to an open file"""
+
+        start = len(self.MAGIC) + 8
+        f.write(self.MAGIC + struct.pack("<Q", len(header)) + header)
+        f.write(b"\0" * (_align(start + len(header)) - start - len(header)))
+        columns.write(f)
+
+
+def _evict(directory, max_size):
+    """Deletes the least recently used sidecars and indexes of a cache directory until they fit in max_size bytes together"""
+
+    files = []
+    for name in os.listdir(directory):
+        if name.endswith(ParseCache.SUFFIX) or name.endswith(FileIndex.SUFFIX):
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime_ns, stat.st_size, name))
+
+    total = sum([size for used, size, name in files])
+    for used, size, name in sorted(files):
+        if total <= max_size:
+            break
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+        total -= size
+
+
+def _align(offset):
+    """Rounds an offset up to a multiple of 8 bytes, so that the columns can be read in place"""
+
+    return (offset + 7) & ~7
+
+
+def _contentHash(this_file):
+    """Returns the sha1 hash of the content of a file"""
+
+    digest = hashlib.sha1()
+    f = open(this_file, "rb")
+    try:
+        for block in iter(partial(f.read, 1 << 20), b""):
+            digest.update(block)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+
+class _Columns(object):
+    """All the lines of one csv file, stored column by column. ids and scores are arrays of int64 and float64, schools, courses and dates are int32 codes into school_names, course_names and date_names. The columns are either arrays or memoryviews of a memory-mapped sidecar"""
+
+    __slots__ = ("ids", "scores", "schools", "courses", "dates", "school_names", "course_names", "date_names")
+
+    def __init__(self, ids, scores, schools, courses, dates, school_names, course_names, date_names):
+        self.ids = ids
+        self.scores = scores
+        self.schools = schools
+        self.courses = courses
+        self.dates = dates
+        self.school_names = school_names
+        self.course_names = course_names
+        self.date_names = date_names
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def byteSize(rows):
+        """The number of bytes the columns of that many rows take in a sidecar"""
+        return _align(8*rows) + _align(8*rows) + _align(4*rows) + _align(4*rows) + _align(4*rows)
+
+    @staticmethod
+    def fromBuffer(buffer, offset, header):
+        """Makes _Columns that read the columns in place from a buffer, such as a memory-mapped sidecar"""
+        rows = header["rows"]
+        view = memoryview(buffer)
+        columns = []
+        for code, size in [("q", 8), ("d", 8), ("i", 4), ("i", 4), ("i", 4)]:
+            columns.append(view[offset:offset + size*rows].cast(code))
+            offset += _align(size*rows)
+        return _Columns(columns[0], columns[1], columns[2], columns[3], columns[4], header["schools"], header["courses"], header["dates"])
+
+    def write(self, f):
+        """Writes the columns to a file in the layout fromBuffer reads"""
+        for column in [self.ids, self.scores, self.schools, self.courses, self.dates]:
+            data = column.tobytes()
+            f.write(data)
+            f.write(b"\0" * (_align(len(data)) - len(data)))
+
+    def select(self, university = None, where = None):
+        """Returns the scores of the lines of university (or of every school) that the RowFilter where matches, as {school: _ScoreRows} in the order of the file. With NumPy the lines are picked with vectorized lookups of the codes, and the columns of the scores are NumPy arrays"""
+
+        if university is not None:
+            if university not in self.school_names:
+                return {}
+            wanted = self.school_names.index(university)
+        if where is not None:
+            #The filter is checked once for each course and date name, and then looked up by code
+            courses = [where.matchesCourse(name) for name in self.course_names]
+            dates = [where.matchesDate(name) for name in self.date_names]
+
+        if np is not None:
+            schools = np.asarray(self.schools)
+            ids = np.asarray(self.ids)
+            scores = np.asarray(self.scores)
+            selected = None
+            if where is not None:
+                selected = np.array(courses, dtype=bool)[np.asarray(self.courses)] & np.array(dates, dtype=bool)[np.asarray(self.dates)]
+            if university is not None:
+                rows = np.flatnonzero(schools == wanted if selected is None else (schools == wanted) & selected)
+                return {university: _ScoreRows(ids[rows], scores[rows])} if len(rows) > 0 else {}
+            if selected is not None:
+                schools, ids, scores = schools[selected], ids[selected], scores[selected]
+
+            #A stable sort keeps the lines of each school in their original order
+            order = np.argsort(schools, kind="stable")
+            bounds = np.searchsorted(schools[order], np.arange(len(self.school_names) + 1))
+            output = {}
+            for code, name in enumerate(self.school_names):
+                rows = order[bounds[code]:bounds[code + 1]]
+                if len(rows) > 0:
+                    output[name] = _ScoreRows(ids[rows], scores[rows])
+            return output
+
+        if university is not None:
+            part = _ScoreRows()
+            for row in _codeRows(self.schools, wanted):
+                if where is None or courses[self.courses[row]] and dates[self.dates[row]]:
+                    part.add(self.ids[row], self.scores[row])
+            return {university: part} if len(part) > 0 else {}
+
+        parts = [_ScoreRows() for name in self.school_names]
+        if where is None:
+            for student_id, score, school in zip(self.ids, self.scores, self.schools):
+                parts[school].add(student_id, score)
+        else:
+            for student_id, score, school, course, date in zip(self.ids, self.scores, self.schools, self.courses, self.dates):
+                if courses[course] and dates[date]:
+                    parts[school].add(student_id, score)
+        return dict((name, part) for name, part in zip(self.school_names, parts) if len(part) > 0)
+
+
+def _codeRows(column, code):
+    """Yields the rows of a column of int32 codes that hold code, in order. Like the prefilter of _readFilePrefiltered, the bytes of the column are searched for the bytes of the code, which skips the other rows without Python code"""
+
+    data = column.tobytes()
+    pattern = array("i", [code]).tobytes()
+    found = data.find(pattern)
+    while found >= 0:
+        #A match that is not on a row boundary is made of the bytes of two codes
+        if found % 4 == 0:
+            yield found // 4
+            found = data.find(pattern, found + 4)
+        else:
+            found = data.find(pattern, found + 1)
+
+
+def _parseColumnsWith(this_file, engine = "python", digest = None):
+    """Parses a whole file into _Columns with the parser of the engine. If a hashlib digest is given, the bytes of the file are added to it"""
+
+    if engine == "numpy":
+        return _parseColumnsChunked(this_file, digest)
+    return _parseColumns(this_file, digest)
+
+
+def _parseColumns(this_file, digest = None):
+    """Parses a whole file into _Columns, checking the lines with the same rules as _readFile"""
+
+    ids = array("q")
+    scores = array("d")
+    schools = array("i")
+    courses = array("i")
+    dates = array("i")
+    school_codes = {}
+    course_codes = {}
+    date_codes = {}
+    try:
+        f = _openFile(this_file, digest = digest)
+    except IOError:
+        error_string = "Could not open "+ str(this_file)+". Check that the path is correct."
+        raise FileError (error_string)
+
+    error_string = "The file "+str(this_file)+" is not formatted in the correct format."
+    try:
+        for line in f:
+            data_line = line.strip().split(",")
+            if(len(data_line) != 5):
+                raise FileError(error_string+" Length != 5")
+            try:
+                student_id = int(data_line[0])
+                scores.append(float(data_line[4]))
+            except ValueError:
+                raise FileError(error_string+" student_id or score not numeric")
+            try:
+                ids.append(student_id)
+            except OverflowError:
+                #Ids beyond 64 bits are kept in a list instead, and such a file is not cached
+                ids = ids.tolist()
+                ids.append(student_id)
+            schools.append(school_codes.setdefault(data_line[2].strip('"'), len(school_codes)))
+            courses.append(course_codes.setdefault(data_line[1].strip('"'), len(course_codes)))
+            dates.append(date_codes.setdefault(data_line[3].strip().strip('"'), len(date_codes)))
+    finally:
+        f.close()
+
+    return _Columns(ids, scores, schools, courses, dates, sorted(school_codes, key=school_codes.get), sorted(course_codes, key=course_codes.get), sorted(date_codes, key=date_codes.get))
+
+
+def _parseColumnsChunked(this_file, digest = None):
+    """Does the same as _parseColumns with the chunked NumPy parser of the numpy engine. The names in each chunk are coded with np.unique, and their codes are then mapped to the codes of the whole file"""
+
+    try:
+        f = _openFile(this_file, binary = True, digest = digest)
+    except IOError:
+        error_string = "Could not open "+ str(this_file)+". Check that the path is correct."
+        raise FileError (error_string)
+
+    error_string = "The file "+str(this_file)+" is not formatted in the correct format."
+    numbers = ([], [])
+    codes = ({}, {}, {})
+    columns = ([], [], [])
+    try:
+        for chunk in _chunks(f):
+            buf, starts, commas, ends = _chunkFields(chunk, error_string)
+            for column, values in zip(numbers, _chunkNumbers(buf, starts, commas, ends, error_string)):
+                column.append(values)
+            #The school, course and date, stripped as _parseColumns strips them
+            names = [np.char.strip(_fields(buf, commas[:, 1] + 1, commas[:, 2]), b'"'), np.char.strip(_fields(buf, commas[:, 0] + 1, commas[:, 1]), b'"'),
+                     np.char.strip(np.char.strip(_fields(buf, commas[:, 2] + 1, commas[:, 3])), b'"')]
+            for column, name_codes, values in zip(columns, codes, names):
+                unique, inverse = np.unique(values, return_inverse = True)
+                column.append(np.array([name_codes.setdefault(name, len(name_codes)) for name in unique.tolist()], dtype=np.int32)[inverse.ravel()])
+    finally:
+        f.close()
+
+    #Python would decode the file with this encoding in _parseColumns
+    encoding = locale.getpreferredencoding(False)
+    arrays = [np.concatenate(column) if column else np.empty(0, dtype=dtype) for column, dtype in zip(numbers + columns, [np.int64, np.float64, np.int32, np.int32, np.int32])]
+    names = [[name.decode(encoding) for name in sorted(name_codes, key=name_codes.get)] for name_codes in codes]
+    return _Columns(*(arrays + names))
+
+
+#An indexed file is cut into blocks of about this many bytes
+INDEX_BLOCK = 1 << 16
+
+class FileIndex(_CacheDirectory):
+    """An on-disk index of where the lines of each (school, course, month) are in csv files. A file is cut into blocks of about INDEX_BLOCK bytes at line boundaries, and the index lists the blocks in which each (school, course, month) appears. A query for one school, course or range of dates then only reads the blocks that may hold its lines, and skips the rest of the file without reading it. This pays off when the lines of a school, course or month are close together, as in files written in date order.
+    As with the prefilter of _readFilePrefiltered, the lines in skipped blocks are not checked. The index of a file is made the first time it is used, and made again when the size or modification time of the file change. Indexes are kept in directory, next to the sidecars of the ParseCache by default. When the indexes and sidecars of the directory take more than max_size bytes, the least recently used ones are deleted"""
+
+    __slots__ = ()
+
+    #Bump the version whenever the layout of the indexes changes
+    VERSION = 1
+    SUFFIX = ".ecdfindex"
+
+    def readFile(self, this_file, university = None, where = None, stats = None, data = None, kind = StudentAggregate):
+        """Does the same as _readFile, but only reads the blocks of the file that may hold lines of university matched by where. Compressed files cannot be read in blocks, so they are read with _readFile"""
+
+        if _compression(this_file) is not None:
+            return _readFile(this_file, university, stats, where, data, kind)
+        if stats is None:
+            stats = Stats()
+
+        if data is None:
+            data = {}
+        encoding = locale.getpreferredencoding(False)
+        error_string = "The file "+str(this_file)+" is not formatted in the correct format."
+        for block in self._blocks(this_file, university, where, stats):
+            with stats.stage("read"):
+                #This splits the lines as reading the file as text would
+                lines = io.TextIOWrapper(io.BytesIO(block), encoding = encoding).readlines()
+            stats.countRows(this_file, len(lines))
+            with stats.stage("parse"):
+                _addLines(lines, university, where, data, error_string, kind)
+        return data
+
+    def readRows(self, this_file, university = None, where = None, stats = None, data = None, kind = StudentAggregate):
+        """Does the same as _readFileNumpy, but only parses the blocks of the file that may hold lines of university matched by where"""
+
+        if _compression(this_file) is not None:
+            return _readFileNumpy(this_file, university, stats, where, data, kind)
+        if data is None:
+            data = {}
+        if stats is None:
+            stats = Stats()
+
+        encoding = locale.getpreferredencoding(False)
+        target = None if university is None else university.encode(encoding)
+        error_string = "The file "+str(this_file)+" is not formatted in the correct format."
+        groups = _ChunkGroups(data, kind, encoding)
+        for block in self._blocks(this_file, university, where, stats):
+            for chunk in _chunks(io.BytesIO(block), stats):
+                _parseChunk(chunk, target, groups, error_string, stats, this_file, None if where is None else where.encode(encoding))
+        return groups.finish()
+
+    def _blocks(self, this_file, university, where, stats):
+        """Yields the bytes of the runs of blocks of a file that may hold lines of university matched by where, in the order of the file, making the index of the file first if needed"""
+
+        with stats.stage("index"):
+            index = self.load(this_file)
+            if index is None:
+                index = self.build(this_file)
+                self.store(this_file, index)
+
+        #The blocks are read in the order of the file, so the scores are added in the same order as by _readFile
+        blocks = set()
+        for school, course, month, runs in index["keys"]:
+            if (university is None or school == university) and (where is None or where.mayMatch(course, month)):
+                for first, last in runs:
+                    blocks.update(range(first, last + 1))
+        offsets = index["offsets"]
+
+        try:
+            f = open(this_file, "rb")
+        except IOError:
+            error_string = "Could not open "+ str(this_file)+". Check that the path is correct."
+            raise FileError (error_string)
+        try:
+            for first, last in _runs(sorted(blocks)):
+                with stats.stage("read"):
+                    f.seek(offsets[first])
+                    block = f.read(offsets[last + 1] - offsets[first])
+                yield block
+        finally:
+            f.close()
+
+    def build(self, this_file):
+        """Scans a file and returns its index, as a dictionary {"offsets": [offset of each block, and the end of the file], "keys": [[school, course, month, runs]]}, where runs lists the blocks of each key as [first, last] pairs"""
+
+        encoding = locale.getpreferredencoding(False)
+        error_string = "The file "+str(this_file)+" is not formatted in the correct format."
+        offsets = [0]
+        keys = {}
+        position = 0
+        try:
+            f = open(this_file, "rb")
+        except IOError:
+            error_string = "Could not open "+ str(this_file)+". Check that the path is correct."
+            raise FileError (error_string)
+        try:
+            for line in f:
+                if position - offsets[-1] >= INDEX_BLOCK:
+                    offsets.append(position)
+                position += len(line)
+                data_line = line.split(b",")
+                if(len(data_line) != 5):
+                    raise FileError(error_string+" Length != 5")
+                key = (data_line[2].strip(b'"'), data_line[1].strip(b'"'), data_line[3].strip().strip(b'"')[:7])
+                blocks = keys.get(key)
+                block = len(offsets) - 1
+                if blocks is None:
+                    keys[key] = [block]
+                elif blocks[-1] != block:
+                    blocks.append(block)
+        finally:
+            f.close()
+        offsets.append(position)
+
+        #The names are stored as text; undecodable bytes survive the round trip as surrogates
+        return {"offsets": offsets, "keys": [[school.decode(encoding, "surrogateescape"), course.decode(encoding, "surrogateescape"), month.decode(encoding, "surrogateescape"), _runs(blocks)]
+                                             for (school, course, month), blocks in keys.items()]}
+
+    def load(self, this_file):
+        """Returns the index of a file, or None if it has not been made or the file has changed"""
+
+        try:
+            stat = os.stat(this_file)
+            with open(self._path(this_file)) as f:
+                index = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(index, dict) or index.get("version") != self.VERSION or index.get("size") != stat.st_size or index.get("mtime") != stat.st_mtime_ns:
+            return None
+        self._used(this_file)
+        return index
+
+    def store(self, this_file, index):
+        """Writes the index of a file"""
+
+        try:
+            stat = os.stat(this_file)
+        except OSError:
+            return
+        index = dict(index, version = self.VERSION, source = os.path.abspath(this_file), size = stat.st_size, mtime = stat.st_mtime_ns)
+        self._write(this_file, operator.methodcaller("write", json.dumps(index).encode("utf-8")))
+
+
+def _runs(numbers):
+    """Groups sorted numbers into runs of consecutive numbers, returned as [first, last] pairs"""
+
+    runs = []
+    for number in numbers:
+        if runs and runs[-1][1] == number - 1:
+            runs[-1][1] = number
+        else:
+            runs.append([number, number])
+    return runs
+
+
+class Snapshot(object):
+    """The per-student sums and counts of every school, together with the list of files they were made from. A snapshot can be saved to a file and loaded again later, so that only the files that are new since then have to be read. Snapshots made from different files can be merged.
+    Files are recorded by their absolute path, size, modification time and content hash, so that a file that changed after it was added is noticed"""
+
+    __slots__ = ("aggregates", "files")
+
+    #Bump the version whenever the layout of the snapshot files changes
+    MAGIC = b"ECDFSNAP"
+    VERSION = 1
+
+    def __init__(self):
+        self.aggregates = {}
+        self.files = []
+
+    def update(self, files, jobs = 1, engine = "python", cache = None, stats = None):
+        """Reads the files that are not in the snapshot yet and adds them to it. The scores are added in the same order as a single run over all the files would add them, so the result is exactly the same"""
+
+        _checkFiles(files)
+        _checkJobs(jobs)
+        _checkEngine(engine)
+
+        known = dict((record["path"], record) for record in self.files)
+        new_files = []
+        for this_file in files:
+            path = os.path.abspath(this_file)
+            if path not in known:
+                new_files.append(this_file)
+                known[path] = None
+            elif known[path] is not None and not _sameFile(this_file, known[path]):
+                raise FileError("The file "+str(this_file)+" has changed since it was added to the snapshot")
+
+        if new_files:
+            _readFiles(new_files, None, jobs, engine, cache, self.aggregates, stats)
+            self.files.extend([_fileRecord(this_file) for this_file in new_files])
+        return new_files
+
+    def merge(self, other):
+        """Adds the aggregates of another snapshot, made from other files, to this one. The sums of a student found in both snapshots are added together, so an average may differ in its last digits from the one of a single run over all the files"""
+
+        paths = set([record["path"] for record in self.files])
+        for record in other.files:
+            if record["path"] in paths:
+                raise InvalidArgumentError("The file "+record["path"]+" is in both snapshots")
+        _mergeInto(self.aggregates, other.aggregates)
+        self.files.extend(other.files)
+
+    def save(self, path):
+        """Writes the snapshot to a file"""
+
+        schools = sorted(self.aggregates)
+        header = {"version": self.VERSION, "files": self.files, "schools": [[school, len(self.aggregates[school])] for school in schools]}
+        header = json.dumps(header).encode("utf-8")
+        try:
+            ids = dict((school, self.aggregates[school].ids()) for school in schools)
+        except OverflowError:
+            raise FileError("Could not write the snapshot "+str(path)+". "+ID_LIMIT)
+
+        #The snapshot is written under a temporary name and then renamed, so that a reader never sees half of it
+        temporary = path + "." + str(os.getpid())
+        try:
+            f = open(temporary, "wb")
+            try:
+                f.write(self.MAGIC + struct.pack("<Q", len(header)) + header)
+                for school in schools:
+                    aggregate = self.aggregates[school]
+                    for column in [ids[school], aggregate.sums, aggregate.counts]:
+                        f.write(_littleEndian(column).tobytes())
+            finally:
+                f.close()
+            os.replace(temporary, path)
+        except (IOError, OSError):
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            raise FileError("Could not write the snapshot "+str(path))
+
+    @staticmethod
+    def load(path):
+        """Reads a snapshot written by save"""
+
+        try:
+            f = open(path, "rb")
+            try:
+                content = f.read()
+            finally:
+                f.close()
+        except (IOError, OSError):
+            raise FileError("Could not open "+ str(path)+". Check that the path is correct.")
+
+        error_string = "The file "+str(path)+" is not a valid snapshot."
+        try:
+            header, offset = Snapshot._header(content)
+        except (ValueError, KeyError, TypeError, struct.error):
+            raise FileError(error_string)
+        if header["version"] != Snapshot.VERSION:
+            raise FileError(error_string+" It was written by another version of this program")
+
+        snapshot = Snapshot()
+        snapshot.files = header["files"]
+        for school, rows in header["schools"]:
+            columns = []
+            for code in ["q", "d", "q"]:
+                column = array(code)
+                column.frombytes(content[offset:offset + 8*rows])
+                if len(column) != rows:
+                    raise FileError(error_string+" It is truncated")
+                columns.append(_littleEndian(column))
+                offset += 8*rows
+            snapshot.aggregates[school] = StudentAggregate.fromColumns(columns[0].tolist(), columns[1], columns[2])
+        return snapshot
+
+    @staticmethod
+    def _header(content):
+        """Reads the header of a snapshot. Returns (header, offset of the first column), and raises ValueError, KeyError, TypeError or struct.error if the header is not valid"""
+
+        start = len(Snapshot.MAGIC) + 8
+        if content[:len(Snapshot.MAGIC)] != Snapshot.MAGIC:
+            raise ValueError("not a snapshot")
+        length = struct.unpack("<Q", content[len(Snapshot.MAGIC):start])[0]
+        header = json.loads(content[start:start+length].decode("utf-8"))
+        if not isinstance(header, dict):
+            raise TypeError("bad snapshot header")
+        if header.get("version") != Snapshot.VERSION:
+            return header, start + length
+        if not isinstance(header["files"], list) or not isinstance(header["schools"], list):
+            raise TypeError("bad snapshot header")
+        for record in header["files"]:
+            for key, kind in [("path", str), ("size", int), ("mtime", int), ("hash", str)]:
+                if not isinstance(record[key], kind):
+                    raise TypeError("bad snapshot header")
+        for school, rows in header["schools"]:
+            if not isinstance(school, str) or not isinstance(rows, int) or rows < 0:
+                raise TypeError("bad snapshot header")
+        return header, start + length
+
+
+def _littleEndian(column):
+    """Returns the array with the bytes of each item in little-endian order, the order of the columns in a snapshot. On a big-endian machine a swapped copy is returned, and the same call turns a column that was read back into native order"""
+
+    if sys.byteorder == "big":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column
+
+
+def _fileRecord(this_file):
+    """Describes a file as it is recorded in a Snapshot"""
+
+    stat = os.stat(this_file)
+    return {"path": os.path.abspath(this_file), "size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": _contentHash(this_file)}
+
+
+def _sameFile(this_file, record):
+    """Checks that a file is still the one described by a record made by _fileRecord. The content hash is only compared if the modification time changed"""
+
+    try:
+        stat = os.stat(this_file)
+    except OSError:
+        raise FileError("Could not open "+ str(this_file)+". Check that the path is correct.")
+    if stat.st_size != record["size"]:
+        return False
+    return stat.st_mtime_ns == record["mtime"] or _contentHash(this_file) == record["hash"]
+
+
+#The ways makeECDF can pick or interpolate a quantile that falls between two scores, as in np.quantile
+METHODS = ("lower", "linear", "nearest", "midpoint")
+
+def makeECDF(data, presorted = True, check = True, stats = None, quantiles = None, method = "lower"):
+    """This function will take the average test scores made by getData and calculate the 100 percentiles without interpolation. It will the output an array of 100 floats that correspond to the percentiles.
+    With presorted = False the data may be in any order, and the 100 percentiles are picked out with a selection algorithm instead of a full sort. A caller that knows its data is sorted can pass check = False to skip the check. If a Stats is given, the time of the check and of the selection are recorded in it.
+    quantiles is a list of other quantiles to calculate, as fractions from 0 to 1 (such as [0.1, 0.5, 0.9] for deciles and the median), and method is one of METHODS, with the meaning it has in np.quantile. Then the output is the same as np.quantile(data, quantiles, method = method)"""
+
+    if stats is None:
+        stats = Stats()
+
+    if not isinstance(data, list): 
+        """Check to make sure data is a list"""
+        raise InvalidArgumentError("makeECDF only accepts lists")
+
+    quantiles = _checkQuantiles(quantiles, method)
+    
+    if presorted and check:
+        with stats.stage("check"):
+            if not _isSorted(data):
+                """Checking to make sure the data is sorted"""
+                raise InvalidArgumentError("makeECDF accepts only sorted lists")
+
+    if len(data) == 0:
+        """There must be some data for us to run ECDF on"""
+        raise InvalidArgumentError("The length of the data was zero. There must be at least one data point.")
+
+
+    n = len(data)-1 #the negative one makes it match up with np.percentile
+    if quantiles is None and method == "lower":
+        indices = [int(n*i/100) for i in range(100)]
+        with stats.stage("select"):
+            if presorted:
+                return [data[i] for i in indices]
+            return _select(data, indices)
+
+    if quantiles is None:
+        quantiles = [i/100 for i in range(100)]
+    with stats.stage("select"):
+        return _quantiles(data, quantiles, method, presorted)
+
+
+def _checkQuantiles(quantiles, method):
+    """Checks the quantiles and method given to makeECDF, and returns the quantiles as a list (or None)"""
+
+    if method not in METHODS:
+        raise InvalidArgumentError("The method must be one of "+", ".join(METHODS))
+
+    if quantiles is not None:
+        if np is not None and isinstance(quantiles, np.ndarray):
+            quantiles = quantiles.tolist()
+        if not isinstance(quantiles, (list, tuple)) or len(quantiles) == 0:
+            raise InvalidArgumentError("The quantiles must be a list of numbers from 0 to 1")
+        if not all([isinstance(q, (int, float)) and not isinstance(q, bool) and 0 <= q <= 1 for q in quantiles]):
+            raise InvalidArgumentError("The quantiles must be a list of numbers from 0 to 1")
+    return quantiles
+
+
+def _quantiles(data, quantiles, method, presorted, view = None):
+    """Calculates the quantiles of data the way np.quantile does. The order statistics on both sides of every quantile are picked out together, with one selection over the data, and then interpolated. With NumPy, each step is one vectorized call over all the quantiles.
+    view may be a NumPy array of the sorted data. The order statistics are then taken from it in one call, and the quantiles are returned as an array instead of a list"""
+
+    n = len(data)
+    if np is not None:
+        position = (n - 1) * np.asarray(quantiles, dtype=np.float64)
+        if method == "lower":
+            below = above = np.floor(position).astype(np.intp)
+        elif method == "nearest":
+            #np.around rounds halves to even, as np.quantile does
+            below = above = np.around(position).astype(np.intp)
+        else:
+            below = np.floor(position).astype(np.intp)
+            above = np.minimum(below + 1, n - 1) if method == "linear" else np.ceil(position).astype(np.intp)
+
+        if view is not None:
+            values = view[np.concatenate((below, above))]
+        else:
+            indices = np.concatenate((below, above)).tolist()
+            values = [data[i] for i in indices] if presorted else _select(data, indices)
+        if method in ("lower", "nearest"):
+            return values[:len(quantiles)]
+
+        values = np.asarray(values, dtype=np.float64)
+        a, b = values[:len(quantiles)], values[len(quantiles):]
+        gamma = position - below if method == "linear" else np.where(above == below, 0.0, 0.5)
+        #The same interpolation as np.quantile, which works from the nearer end so that the result stays between a and b
+        result = np.where(gamma >= 0.5, b - (b - a) * (1 - gamma), a + (b - a) * gamma)
+        return result if view is not None else result.tolist()
+
+    #Without NumPy, the same floating point steps are done one quantile at a time
+    positions = [(n - 1) * float(q) for q in quantiles]
+    if method == "lower":
+        below = above = [int(math.floor(position)) for position in positions]
+    elif method == "nearest":
+        #round also rounds halves to even
+        below = above = [int(round(position)) for position in positions]
+    else:
+        below = [int(math.floor(position)) for position in positions]
+        above = [min(i + 1, n - 1) for i in below] if method == "linear" else [int(math.ceil(position)) for position in positions]
+
+    values = [data[i] for i in below + above] if presorted else _select(data, below + above)
+    if method in ("lower", "nearest"):
+        return values[:len(quantiles)]
+
+    result = []
+    for position, i, j, a, b in zip(positions, below, above, values[:len(quantiles)], values[len(quantiles):]):
+        a, b = float(a), float(b)
+        gamma = position - i if method == "linear" else (0.0 if i == j else 0.5)
+        result.append(b - (b - a) * (1 - gamma) if gamma >= 0.5 else a + (b - a) * gamma)
+    return result
+
+
+def _select(data, indices):
+    """Returns [sorted(data)[i] for i in indices] without sorting all of data. With NumPy, argpartition places all of the requested order statistics in one call, and we return the original elements of data at those places"""
+
+    if np is None:
+        data = sorted(data)
+        return [data[i] for i in indices]
+
+    order = np.argpartition(np.asarray(data, dtype=np.float64), np.unique(indices))
+    return [data[order[i]] for i in indices]
+
+
+def _isSorted(data):
+    """Checks in one pass that data is in increasing order"""
+
+    return all(map(operator.le, data, islice(data, 1, None)))
+
+
+class ECDF(object):
+    """The empirical cumulative distribution function of a list of average test scores, such as the one getData returns. The scores are kept sorted in a read-only array of doubles, and the object cannot be changed once it is made.
+    cdf(x) gives the fraction of students whose score is at most x, and quantile(q) the score below which a fraction q of the students fall. Both take a number, a list or a NumPy array, and return the same kind. ks(other) is the Kolmogorov-Smirnov statistic between two ECDFs, and ksMatrix compares many of them at once"""
+
+    __slots__ = ("values", "_view")
+
+    def __init__(self, data, presorted = True, check = True):
+        if not isinstance(data, list) and not (np is not None and isinstance(data, np.ndarray)):
+            raise InvalidArgumentError("ECDF only accepts lists")
+        if len(data) == 0:
+            raise InvalidArgumentError("The length of the data was zero. There must be at least one data point.")
+        values = array("d", data if presorted else sorted(data))
+        if presorted and check and not _isSorted(values):
+            raise InvalidArgumentError("ECDF accepts only sorted lists, unless presorted = False")
+
+        values = memoryview(values).toreadonly()
+        object.__setattr__(self, "values", values)
+        #A NumPy view of the same memory, for the vectorized lookups
+        object.__setattr__(self, "_view", None if np is None else np.frombuffer(values, dtype=np.float64))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("An ECDF cannot be changed")
+
+    def __reduce__(self):
+        return (ECDF, (self.values.tolist(), True, False))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return "ECDF(%d scores from %r to %r)" % (len(self.values), self.values[0], self.values[-1])
+
+    def cdf(self, x):
+        """The fraction of the scores that are less than or equal to x"""
+        n = float(len(self.values))
+        if np is not None and isinstance(x, np.ndarray):
+            return np.searchsorted(self._view, x, side = "right") / n
+        if isinstance(x, (list, tuple)):
+            return [bisect.bisect_right(self.values, value) / n for value in x]
+        return bisect.bisect_right(self.values, x) / n
+
+    def quantile(self, q, method = "lower"):
+        """The score at the fraction q of the scores (from 0 to 1), picked or interpolated with method as in makeECDF"""
+        if np is not None and isinstance(q, np.ndarray):
+            if method not in METHODS or q.size == 0 or not ((q >= 0) & (q <= 1)).all():
+                raise InvalidArgumentError("The quantiles must be numbers from 0 to 1, and the method one of "+", ".join(METHODS))
+            return _quantiles(self.values, q.ravel(), method, True, self._view).reshape(q.shape)
+        if isinstance(q, (list, tuple)):
+            return _quantiles(self.values, _checkQuantiles(q, method), method, True)
+        return _quantiles(self.values, _checkQuantiles([q], method), method, True)[0]
+
+    def percentiles(self, method = "lower"):
+        """The 100 percentiles of makeECDF, ready for printECDF"""
+        _checkQuantiles(None, method)
+        n = len(self.values)-1
+        if method == "lower":
+            return [self.values[int(n*i/100)] for i in range(100)]
+        return _quantiles(self.values, [i/100 for i in range(100)], method, True)
+
+    def ks(self, other):
+        """The two-sample Kolmogorov-Smirnov statistic: the largest difference between the two cdfs at any score"""
+        if not isinstance(other, ECDF):
+            raise InvalidArgumentError("ks compares two ECDFs")
+        a, b = self.values, other.values
+        n, m = float(len(a)), float(len(b))
+        if np is not None:
+            points = np.concatenate((self._view, other._view))
+            return float(np.abs(np.searchsorted(self._view, points, side = "right") / n - np.searchsorted(other._view, points, side = "right") / m).max())
+
+        #Without NumPy, both sorted lists are walked together, comparing the cdfs after each distinct score
+        i = j = 0
+        largest = 0.0
+        while i < len(a) and j < len(b):
+            x = min(a[i], b[j])
+            while i < len(a) and a[i] <= x:
+                i += 1
+            while j < len(b) and b[j] <= x:
+                j += 1
+            largest = max(largest, abs(i / n - j / m))
+        return largest
+
+
+def ksMatrix(ecdfs):
+    """Returns the Kolmogorov-Smirnov statistic between every pair of a list of ECDFs, as a list of lists with ksMatrix(ecdfs)[i][j] == ecdfs[i].ks(ecdfs[j]).
+    With NumPy, each row of the matrix takes a few vectorized calls. The scores of all the ECDFs are put in one sorted array of keys (ECDF number, rank of the score among all the scores), so that the cdf of every ECDF at every score of another one is one searchsorted over the keys"""
+
+    if not isinstance(ecdfs, list) or not all([isinstance(ecdf, ECDF) for ecdf in ecdfs]):
+        raise InvalidArgumentError("ksMatrix needs a list of ECDFs")
+
+    if np is None or len(ecdfs) == 0:
+        return [[a.ks(b) if a is not b else 0.0 for b in ecdfs] for a in ecdfs]
+
+    k = len(ecdfs)
+    sizes = np.array([len(ecdf) for ecdf in ecdfs], dtype=np.float64)
+    offsets = np.zeros(k + 1, dtype=np.intp)
+    offsets[1:] = np.cumsum([len(ecdf) for ecdf in ecdfs])
+    scores = np.concatenate([ecdf._view for ecdf in ecdfs])
+    grid = np.unique(scores)
+    ranks = np.searchsorted(grid, scores)
+    owner = np.repeat(np.arange(k), np.diff(offsets))
+    keys = owner * len(grid) + ranks
+    #The cdf of each ECDF at each of its own scores
+    own = (np.searchsorted(keys, keys, side = "right") - offsets[owner]) / sizes[owner]
+
+    matrix = np.zeros((k, k))
+    for row in range(k - 1):
+        mine = slice(offsets[row], offsets[row + 1])
+        others = np.arange(row + 1, k)
+        #The cdfs of the other ECDFs at the scores of this one...
+        cdfs = (np.searchsorted(keys, others[:, None] * len(grid) + ranks[mine][None, :], side = "right") - offsets[others][:, None]) / sizes[others][:, None]
+        at_mine = np.abs(own[mine][None, :] - cdfs).max(axis = 1)
+        #...and the cdf of this one at the scores of the others
+        differences = np.abs(np.searchsorted(ranks[mine], ranks[offsets[row + 1]:], side = "right") / sizes[row] - own[offsets[row + 1]:])
+        at_theirs = np.maximum.reduceat(differences, offsets[row + 1:-1] - offsets[row + 1])
+        matrix[row, row + 1:] = np.maximum(at_mine, at_theirs)
+    return np.maximum(matrix, matrix.T).tolist()
+
+
+class QuantileSketch(object):
+    """A KLL quantile sketch (Karnin, Lang and Liberty, "Optimal Quantile Approximation in Streams", 2016).
+    The values are kept in a stack of levels. When a level is full it is sorted and every other value is moved up one level, where each value stands for twice as many values. The sketch keeps O(k) values however many are added, and two sketches can be merged.
+    With k = 3/eps the rank of each estimated order statistic is off by less than eps*n with high probability, where n is the number of values added. The seed of the random choices is fixed so that the results can be reproduced"""
+
+    __slots__ = ("eps", "k", "levels", "size", "max_size", "n", "random")
+
+    #The capacity of each level is this fraction of the capacity of the level above it
+    C = 2.0/3.0
+
+    def __init__(self, eps, seed = 0):
+        _checkEps(eps)
+        self.eps = eps
+        self.k = int(math.ceil(3/eps))
+        self.levels = [[]]
+        self.size = 0
+        self.n = 0
+        self.random = random.Random(seed)
+        self.max_size = self._capacity(0)
+
+    def __len__(self):
+        return self.n
+
+    def _capacity(self, level):
+        """The number of values a level can hold before it is compacted. The top level holds k values"""
+        return int(math.ceil(self.C ** (len(self.levels) - level - 1) * self.k)) + 1
+
+    def add(self, value):
+        """Adds one value to the sketch"""
+        self.levels[0].append(value)
+        self.size += 1
+        self.n += 1
+        if self.size >= self.max_size:
+            self._compress()
+
+    def merge(self, other):
+        """Adds all the values of another sketch to this one"""
+        if other.k != self.k:
+            raise InvalidArgumentError("Only sketches with the same rank error can be merged")
+        while len(self.levels) < len(other.levels):
+            self._grow()
+        for level, values in enumerate(other.levels):
+            self.levels[level].extend(values)
+        self.size += other.size
+        self.n += other.n
+        while self.size >= self.max_size:
+            self._compress()
+
+    def _grow(self):
+        self.levels.append([])
+        self.max_size = sum([self._capacity(level) for level in range(len(self.levels))])
+
+    def _compress(self):
+        """Compacts the lowest level that is over capacity"""
+        for level in range(len(self.levels)):
+            if len(self.levels[level]) >= self._capacity(level):
+                if level + 1 >= len(self.levels):
+                    self._grow()
+                values = self.levels[level]
+                values.sort()
+                #An odd value out stays behind, and a random offset picks which half moves up
+                keep = len(values) % 2
+                self.levels[level + 1].extend(values[keep + self.random.randint(0, 1)::2])
+                self.levels[level] = values[:keep]
+                self.size = sum([len(values) for values in self.levels])
+                if self.size < self.max_size:
+                    break
+
+    def select(self, indices):
+        """Returns an estimate of [sorted(values)[i] for i in indices], where values are all the values added so far"""
+        weighted = sorted([(value, 1 << level) for level, values in enumerate(self.levels) for value in values])
+        ranks = []
+        total = 0
+        for value, weight in weighted:
+            total += weight
+            ranks.append(total)
+        return [weighted[bisect.bisect_right(ranks, i)][0] for i in indices]
+
+
+def approxECDF(sketch, quantiles = None):
+    """Does the same as makeECDF, but estimates the 100 percentiles (or the list of quantiles, without interpolation) from a QuantileSketch, such as the one made by getSketch. The output can be given to printECDF"""
+
+    if not isinstance(sketch, QuantileSketch):
+        raise InvalidArgumentError("approxECDF only accepts a QuantileSketch")
+
+    if len(sketch) == 0:
+        """There must be some data for us to run ECDF on"""
+        raise InvalidArgumentError("The length of the data was zero. There must be at least one data point.")
+
+    quantiles = _checkQuantiles(quantiles, "lower")
+    n = len(sketch)-1
+    if quantiles is not None:
+        return sketch.select([int(n*q) for q in quantiles])
+    return sketch.select([int(n*i/100) for i in range(100)])
+
+
+def printECDF(school, ecdf, quantiles = None):
+    """This function will take the output of makeECDF and return a string that has been formatted to meet the requirements stipulated. If makeECDF was given a list of quantiles, pass the same list here: the lines are then labelled with the quantiles instead of the percentiles 1 to 100""" 
+
+    quantiles = _checkECDF(school, ecdf, "printECDF", quantiles)
+
+    return "".join(_textLines(school, ecdf, quantiles))
+
+
+def _checkECDF(school, ecdf, caller, quantiles = None):
+    """Checks the arguments of printECDF and ECDFWriter.write, and returns the quantiles as a list (or None)"""
+
+    if not isinstance(ecdf, list): 
+        """Check to make sure data is a list"""
+        raise InvalidArgumentError(caller+" needs a list")
+    
+    quantiles = _checkQuantiles(quantiles, "lower")
+    size = 100 if quantiles is None else len(quantiles)
+    if len(ecdf) != size:
+        """There must be one score for each percentile or quantile"""
+        raise InvalidArgumentError("The length of the data was not "+str(size)+".")
+
+    #The scores of a list of quantiles in any order must be sorted in the order of the quantiles
+    if not _isSorted(ecdf if quantiles is None else [x for q, x in sorted(zip(quantiles, ecdf))]):
+        """Checking to make sure the data is sorted"""
+        raise InvalidArgumentError(caller+" accepts only sorted lists")
+
+    if not isinstance(school, str): 
+        """Check to make sure data is a list"""
+        raise InvalidArgumentError(caller+" needs the name of a school")
+    return quantiles
+
+
+def _labels(quantiles):
+    """Returns the name and the labels of the rows of the output: the percentiles 1 to 100, or the quantiles given to makeECDF"""
+
+    if quantiles is None:
+        return "percentile", range(1, 101)
+    return "quantile", quantiles
+
+
+def _textLines(school, ecdf, quantiles = None):
+    """The lines of the output of printECDF"""
+
+    name, labels = _labels(quantiles)
+    yield school+ " students\n\n"+name+"\tmean_test_score\n"
+    for label, x in zip(labels, ecdf):
+        yield str(label)+'\t'+str(x)+'\n'
+
+
+#The formats ECDFWriter can write
+FORMATS = ("text", "csv", "jsonl", "npy")
+
+def _checkFormat(format):
+    """Checks that the format is one of FORMATS, and that NumPy is available if it is needed"""
+
+    if format not in FORMATS:
+        raise InvalidArgumentError("The format must be one of: "+", ".join(FORMATS))
+    if format == "npy" and np is None:
+        raise InvalidArgumentError("The npy format requires NumPy to be installed")
+
+class ECDFWriter(object):
+    """Writes the percentiles of one or more schools straight to a file as they are computed, instead of building one string. The formats are:
+    text: the layout of printECDF, with a blank line after each school (what the program has always printed)
+    csv: a header line and then one school,percentile,mean_test_score line per percentile
+    jsonl: one {"school": ..., "percentile": ..., "mean_test_score": ...} object per line
+    npy: a NumPy structured array with one (school, mean_test_score[100]) record per school, or one score per quantile. The header of a .npy file holds the number of records, so this format is written when the writer is closed
+    out may be the name of a file, an open file (binary for npy, text otherwise), or None for the standard output. If the percentiles were made for a list of quantiles, the writer is given the same list, and the rows are labelled "quantile" with its values instead of "percentile" with 1 to 100"""
+
+    __slots__ = ("format", "out", "own", "csv", "records", "quantiles")
+
+    def __init__(self, out = None, format = "text", quantiles = None):
+        _checkFormat(format)
+        self.quantiles = _checkQuantiles(quantiles, "lower")
+
+        self.format = format
+        self.own = isinstance(out, str)
+        if self.own:
+            try:
+                if format == "npy":
+                    out = open(out, "wb")
+                else:
+                    out = open(out, "w", newline = "")
+            except (IOError, OSError):
+                raise FileError("Could not open "+ str(out)+" for writing.")
+        elif out is None:
+            out = sys.stdout.buffer if format == "npy" else sys.stdout
+        self.out = out
+        self.records = []
+        self.csv = None
+        if format == "csv":
+            self.csv = csv.writer(out, lineterminator = "\n")
+            self.csv.writerow(["school", _labels(self.quantiles)[0], "mean_test_score"])
+
+    def write(self, school, ecdf):
+        """Writes the percentiles of one school"""
+
+        _checkECDF(school, ecdf, "ECDFWriter.write", self.quantiles)
+
+        name, labels = _labels(self.quantiles)
+        if self.format == "text":
+            self.out.writelines(_textLines(school, ecdf, self.quantiles))
+            self.out.write("\n")
+        elif self.format == "csv":
+            self.csv.writerows([(school, label, str(x)) for label, x in zip(labels, ecdf)])
+        elif self.format == "jsonl":
+            for label, x in zip(labels, ecdf):
+                self.out.write(json.dumps({"school": school, name: label, "mean_test_score": x}) + "\n")
+        else:
+            self.records.append((school, ecdf))
+
+    def close(self):
+        """Finishes the output, and closes the file if the writer opened it"""
+
+        if self.format == "npy":
+            width = max([1] + [len(school) for school, ecdf in self.records])
+            size = 100 if self.quantiles is None else len(self.quantiles)
+            table = np.array(self.records, dtype=[("school", "U"+str(width)), ("mean_test_score", np.float64, (size,))])
+            np.save(self.out, table)
+            self.records = []
+        if self.own:
+            self.out.close()
+        else:
+            self.out.flush()
+
+    
+
+#The fields a query of a batch manifest may have
+QUERY_FIELDS = ("school", "files", "output", "format", "course", "from", "to", "method", "quantiles")
+
+#The options a batch cannot be run with, as each query sets them in the manifest or a batch has no use for them
+BATCH_IGNORED = ("--format", "--output", "--method", "--quantiles", "--approx", "--course", "--from", "--to", "--index", "--strict", "--snapshot")
+
+def loadManifest(path):
+    """Reads a batch manifest, a JSON file of the form
+    {"queries": [{"school": "ABC University", "files": ["file1.csv", "file2.csv"], "output": "abc.txt"}, ...]}
+    and returns its list of queries. A query without a school asks for every school, as --all-schools does. A query may also have a format (one of FORMATS), a course, a date range ("from" and "to"), a method and a list of quantiles, as on the command line"""
+
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except IOError:
+        raise FileError("Could not open "+str(path)+". Check that the path is correct.")
+    except ValueError:
+        raise FileError("The manifest "+str(path)+" is not valid JSON")
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("queries"), list) or len(manifest["queries"]) == 0:
+        raise InvalidArgumentError('A manifest must have the form {"queries": [{"school": ..., "files": [...], "output": ...}]}')
+
+    for number, query in enumerate(manifest["queries"]):
+        name = "Query "+str(number)+" of "+str(path)
+        if not isinstance(query, dict) or not all([field in QUERY_FIELDS for field in query]):
+            raise InvalidArgumentError(name+" may only have the fields "+", ".join(QUERY_FIELDS))
+        if not isinstance(query.get("output"), str) or not isinstance(query.get("school", ""), (str, type(None))):
+            raise InvalidArgumentError(name+" needs an output file, and its school must be a string")
+        _checkFiles(query.get("files"))
+        if len(query["files"]) == 0:
+            raise InvalidArgumentError(name+" needs at least one file")
+        if query.get("format", "text") not in FORMATS or query.get("method", "lower") not in METHODS:
+            raise InvalidArgumentError(name+" has an unknown format or method")
+        _checkQuantiles(query.get("quantiles"), query.get("method", "lower"))
+        RowFilter(query.get("course"), query.get("from"), query.get("to"))
+
+    outputs = [os.path.abspath(query["output"]) for query in manifest["queries"]]
+    if len(set(outputs)) != len(outputs):
+        duplicate = [output for output in outputs if outputs.count(output) > 1][0]
+        raise InvalidArgumentError("Two queries of "+str(path)+" write to "+duplicate+", so one would overwrite the other")
+    return manifest["queries"]
+
+
+def runBatch(queries, jobs = 1, engine = "python", cache = None, stats = None):
+    """Answers many queries (as returned by loadManifest) while parsing each file they need only once. The files are parsed into columns, and the scores of every distinct (school, filter) asked of them are picked out of the columns. Each query adds up the scores of its own files, in its own order, so its percentiles are exactly the ones a run of the program for that query alone would write. The output of a query is written as soon as all its files are read.
+    A query that finds no data does not stop the others; a FileError naming all of them is raised at the end"""
+
+    _checkJobs(jobs)
+    _checkEngine(engine)
+    if stats is None:
+        stats = Stats()
+
+    #The distinct (school, filter) pairs asked of each file
+    keys = []
+    wanted = {}
+    for query in queries:
+        key = (query.get("school"), query.get("course"), query.get("from"), query.get("to"))
+        keys.append(key)
+        for this_file in query["files"]:
+            wanted.setdefault(this_file, [])
+            if key not in wanted[this_file]:
+                wanted[this_file].append(key)
+
+    #The scores of a file are added to each query that waits for it next as soon as the file is parsed, and dropped once
+    #no query needs them any more, so what is kept grows with the number of students and not with the number of lines.
+    #A query is written as soon as its last file is added
+    files = list(wanted)
+    work = [(this_file, wanted[this_file], engine, cache) for this_file in files]
+    uses = {}
+    for query in queries:
+        for this_file in query["files"]:
+            uses[this_file] = uses.get(this_file, 0) + 1
+    parts = {}
+    data = [{} for query in queries]
+    positions = [0] * len(queries)
+    missing = []
+    pool = Pool(min(jobs, len(files))) if jobs > 1 and len(files) > 1 else None
+    try:
+        results = map(_batchFile, work) if pool is None else pool.imap(_batchFile, work)
+        for this_file, (part, part_stats) in zip(files, results):
+            parts[this_file] = part
+            stats.merge(part_stats)
+            for number, query in enumerate(queries):
+                position = positions[number]
+                with stats.stage("merge"):
+                    while position < len(query["files"]) and query["files"][position] in parts:
+                        ready = query["files"][position]
+                        _addRows(data[number], parts[ready][keys[number]], engine)
+                        position += 1
+                        uses[ready] -= 1
+                        if uses[ready] == 0:
+                            del parts[ready]
+                if position == len(query["files"]) and positions[number] < position:
+                    _writeQuery(query, keys[number][0], data[number], missing, stats)
+                    data[number] = None
+                positions[number] = position
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    if missing:
+        raise FileError("Did not find any data for "+", ".join(missing))
+
+
+def _writeQuery(query, school, data, missing, stats):
+    """Writes the percentiles of a query of a batch from the aggregates of its files. If it found no data for school (or for any school, if school is None), what it asked for is added to missing instead"""
+
+    with stats.stage("merge"):
+        _toAggregates(data)
+    if (school is None and len(data) == 0) or (school is not None and len(data.get(school, ())) == 0):
+        missing.append(school if school is not None else "the files of "+query["output"])
+        return
+
+    writer = _MeasuredWriter(ECDFWriter(query["output"], query.get("format", "text"), query.get("quantiles")), stats)
+    try:
+        for school in ([school] if school is not None else sorted(data)):
+            with stats.stage("average"):
+                means = data[school].means(sort = False)
+            writer.write(school, makeECDF(means, presorted = False, stats = stats, quantiles = query.get("quantiles"), method = query.get("method", "lower")))
+    finally:
+        writer.close()
+
+
+def _batchFile(arguments):
+    """Parses one file of a batch into columns and picks out the scores of each (school, course, from, to) key. Returns ({key: {school: _ScoreRows}}, Stats)"""
+
+    this_file, keys, engine, cache = arguments
+    stats = Stats()
+    if cache is not None:
+        columns = cache.columns(this_file, stats, engine)
+    else:
+        with stats.stage("parse"):
+            columns = _parseColumnsWith(this_file, engine)
+        stats.countRows(this_file, len(columns))
+
+    #Keys with the same filter share one pass over all the schools, unless only one school is asked for
+    by_filter = {}
+    for key in keys:
+        by_filter.setdefault(key[1:], []).append(key[0])
+    part = {}
+    with stats.stage("aggregate"):
+        for (course, start, end), schools in by_filter.items():
+            where = None if (course, start, end) == (None, None, None) else RowFilter(course, start, end)
+            if len(schools) == 1:
+                part[(schools[0], course, start, end)] = columns.select(schools[0], where)
+                continue
+            data = columns.select(None, where)
+            for school in schools:
+                part[(school, course, start, end)] = data if school is None else dict((name, data[name]) for name in [school] if name in data)
+    return part, stats
+
+
+def main(argv):
+    """Runs the program with the command line arguments argv, and prints the percentiles"""
+
+    if len(argv) > 1 and argv[1] == "merge":
+        if len(argv) < 4:
+            raise InvalidArgumentError("""The merge command must be run with the following format: \npython ecdf.py merge all.snap shard1.snap shard2.snap""")
+        snapshot = Snapshot.load(argv[3])
+        for path in argv[4:]:
+            snapshot.merge(Snapshot.load(path))
+        snapshot.save(argv[2])
+        return
+
+    options, argv = parseOptions(argv)
+    cache = None
+    if (options.get("cache") or "cache_dir" in options) and not options.get("no_cache"):
+        cache = ParseCache(options.get("cache_dir"), options.get("cache_size", 1024) << 20)
+    if options.get("clear_cache"):
+        ParseCache(options.get("cache_dir")).clear()
+        FileIndex(options.get("cache_dir")).clear()
+        if len(argv) == 1:
+            return
+
+    jobs = options.get("jobs", 1)
+    engine = options.get("engine", "python")
+    if len(argv) > 1 and argv[1] == "serve":
+        from ecdf_server import serve
+        serve(argv[2:], options.get("host", "127.0.0.1"), options.get("port", 8000), options.get("socket"), jobs, engine, cache, options.get("poll", 2.0))
+        return
+
+    stats = Stats() if options.get("stats") or "stats_json" in options else None
+    if "batch" in options:
+        if len(argv) != 1:
+            raise InvalidArgumentError("""The files of a batch are listed in its manifest: 
+python ecdf.py --batch manifest.json""")
+        ignored = [option for option in BATCH_IGNORED if option[2:].replace("-", "_") in options]
+        if ignored:
+            raise InvalidArgumentError("The queries of a batch are set in its manifest, so it cannot be run with "+", ".join(ignored))
+        try:
+            runBatch(loadManifest(options["batch"]), jobs, engine, cache, stats)
+        finally:
+            _reportStats(options, stats)
+        return
+
+    snapshot_path = options.get("snapshot")
+    where = None
+    if "course" in options or "from" in options or "to" in options:
+        where = RowFilter(options.get("course"), options.get("from"), options.get("to"))
+        if snapshot_path is not None:
+            raise InvalidArgumentError("A snapshot holds the scores of every course and date, so it cannot be filtered")
+    index = None
+    if options.get("index"):
+        if options.get("strict"):
+            raise InvalidArgumentError("--index skips the parts of the files a query does not need, so it cannot be used with --strict")
+        index = FileIndex(options.get("cache_dir"), options.get("cache_size", 1024) << 20)
+    method = options.get("method", "lower")
+    if method not in METHODS:
+        raise InvalidArgumentError("The method must be one of "+", ".join(METHODS))
+    if method != "lower" and "approx" in options:
+        raise InvalidArgumentError("The percentiles of --approx are estimated without interpolation, so they cannot be used with --method")
+    quantiles = _checkQuantiles(options.get("quantiles"), method)
+    school, files = parseArg(argv, need_files = snapshot_path is None)
+    eps = options.get("approx")
+    _checkFormat(options.get("format", "text"))
+
+    #All the files are read before the output is opened, so a query that fails leaves an existing output file as it was.
+    #The percentiles of each school are then made as they are written
+    strict = options.get("strict", False)
+    if snapshot_path is not None:
+        snapshot = Snapshot.load(snapshot_path) if os.path.exists(snapshot_path) else Snapshot()
+        snapshot.update(files, jobs, engine, cache, stats)
+        snapshot.save(snapshot_path)
+        aggregates = snapshot.aggregates
+        schools = sorted(aggregates) if school is None else [school]
+        for school in schools:
+            if school not in aggregates or len(aggregates[school]) == 0:
+                raise FileError ("Did not find any data for "+school)
+        if eps is not None:
+            ecdfs = ((school, approxECDF(aggregates[school].sketch(eps), quantiles)) for school in schools)
+        else:
+            ecdfs = ((school, makeECDF(aggregates[school].means(sort = False), presorted = False, stats = stats, quantiles = quantiles, method = method)) for school in schools)
+    elif eps is not None and school is None:
+        sketches = getAllSketches(files, eps, jobs, engine, cache, stats, where, index, strict)
+        ecdfs = ((school, approxECDF(sketches[school], quantiles)) for school in sorted(sketches))
+    elif eps is not None:
+        ecdfs = [(school, approxECDF(getSketch(school, files, eps, jobs, engine, cache, stats, strict, where, index), quantiles))]
+    elif school is None:
+        all_data = getAllData(files, jobs, engine, sort = False, cache = cache, stats = stats, where = where, index = index, strict = strict)
+        ecdfs = ((school, makeECDF(all_data[school], presorted = False, stats = stats, quantiles = quantiles, method = method)) for school in sorted(all_data))
+    else:
+        data = getData(school, files, jobs, engine, sort = False, cache = cache, stats = stats, strict = strict, where = where, index = index)
+        ecdfs = [(school, makeECDF(data, presorted = False, stats = stats, quantiles = quantiles, method = method))]
+
+    writer = ECDFWriter(options.get("output"), options.get("format", "text"), quantiles)
+    if stats is not None:
+        writer = _MeasuredWriter(writer, stats)
+    try:
+        for school, ecdf in ecdfs:
+            writer.write(school, ecdf)
+    finally:
+        writer.close()
+
+    _reportStats(options, stats)
+
+
+def _reportStats(options, stats):
+    """Prints or saves the statistics of a run, as asked by --stats and --stats-json"""
+
+    if stats is None:
+        return
+    if options.get("stats"):
+        stats.printReport()
+    if "stats_json" in options:
+        try:
+            with open(options["stats_json"], "w") as f:
+                json.dump(stats.report(), f, indent = 1)
+        except IOError:
+            raise FileError("Could not write the statistics to "+options["stats_json"])
+
+
+class _MeasuredWriter(object):
+    """Wraps an ECDFWriter, recording the time spent writing as the stage output"""
+
+    __slots__ = ("writer", "stats")
+
+    def __init__(self, writer, stats):
+        self.writer = writer
+        self.stats = stats
+
+    def write(self, school, ecdf):
+        with self.stats.stage("output"):
+            self.writer.write(school, ecdf)
+
+    def close(self):
+        with self.stats.stage("output"):
+            self.writer.close()
 
-    
 
 if __name__ == '__main__':
-    school, files = parseArg(sys.argv)
-    data = getData(school, files)
-    ecdf = makeECDF(data)
-    print(printECDF(school, ecdf))
+    main(sys.argv)
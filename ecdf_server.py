@@ -0,0 +1,222 @@
+"""A long running server that answers ECDF queries from memory.
+It is started through ecdf.py in the following manner:
+
+python ecdf.py serve --port 8000 input_file1.csv input_file2.csv
+
+or, to listen on a local Unix socket instead of localhost:
+
+python ecdf.py serve --socket /tmp/ecdf.sock input_file1.csv input_file2.csv
+
+The files are read once, and the sorted average test scores of every school are kept in memory.
+The files are checked every few seconds (--poll 2.0), and read again in the background when one of them changes.
+The server speaks plain HTTP and answers two queries with JSON:
+
+GET /schools
+{"schools": ["ABC University", "Port Chester University"]}
+
+GET /ecdf?school=Port%20Chester%20University&percentiles=1,50,100
+{"school": "Port Chester University", "students": 3, "percentile": [1, 50, 100], "mean_test_score": [0, 5.25, 100]}
+
+Without percentiles, all 100 rows of printECDF are returned. The answers to the most recent queries are kept in an LRU cache.
+"""
+
+import os
+import json
+import asyncio
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+
+from ecdf import InvalidArgumentError, FileError, _checkFiles, _checkJobs, _checkEngine, _readFiles
+
+
+class LRUCache(object):
+    """A dictionary that keeps only the size most recently used entries"""
+
+    __slots__ = ("size", "entries", "hits", "misses")
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the value of key, or None if it is not in the cache"""
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last = False)
+
+
+class ECDFServer(object):
+    """Keeps the sorted average test scores of every school found in files, and answers queries about them"""
+
+    def __init__(self, files, jobs = 1, engine = "python", cache = None, cache_size = 1024, poll = 2.0):
+        _checkFiles(files)
+        _checkJobs(jobs)
+        _checkEngine(engine)
+
+        self.files = files
+        self.jobs = jobs
+        self.engine = engine
+        self.cache = cache
+        self.poll = poll
+        self.cache_size = cache_size
+        self.state = ({}, LRUCache(cache_size))
+        self.stamps = None
+        self.load()
+
+    def _stamps(self):
+        """The size and modification time of every file, to notice when they change"""
+        stamps = []
+        for this_file in self.files:
+            try:
+                stat = os.stat(this_file)
+                stamps.append((stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                stamps.append(None)
+        return stamps
+
+    def load(self):
+        """Reads the files and replaces the scores in memory. The old scores are served until the new ones are ready"""
+        stamps = self._stamps()
+        data = _readFiles(self.files, None, self.jobs, self.engine, self.cache)
+        if len(data) == 0:
+            raise FileError ("Did not find any data in the files supplied")
+        means = dict((school, data[school].means()) for school in data)
+
+        #The scores and the cache of their results are swapped in one step, so a query sees either the old or the new ones
+        self.state = (means, LRUCache(self.cache_size))
+        self.stamps = stamps
+
+    def changed(self):
+        """Checks whether any of the files changed since they were read"""
+        return self._stamps() != self.stamps
+
+    def query(self, school, percentiles = None):
+        """Returns the answer to a query as a dictionary, picking the same rows as makeECDF. percentiles is a list of numbers from 1 to 100, as in the first column of printECDF"""
+        if percentiles is None:
+            percentiles = list(range(1, 101))
+        means, results = self.state
+        key = (school, tuple(percentiles))
+        result = results.get(key)
+        if result is not None:
+            return result
+
+        if not all([isinstance(p, int) and 1 <= p <= 100 for p in percentiles]):
+            raise InvalidArgumentError("The percentiles must be whole numbers from 1 to 100")
+        data = means.get(school)
+        if data is None:
+            raise KeyError(school)
+
+        n = len(data)-1
+        result = {"school": school, "students": len(data), "percentile": percentiles, "mean_test_score": [data[int(n*(p-1)/100)] for p in percentiles]}
+        results.put(key, result)
+        return result
+
+    def answer(self, target):
+        """Answers one GET request for target, such as /ecdf?school=X. Returns (HTTP status, dictionary)"""
+        url = urlsplit(target)
+        arguments = parse_qs(url.query)
+        if url.path == "/schools":
+            return 200, {"schools": sorted(self.state[0])}
+        if url.path != "/ecdf":
+            return 404, {"error": "Unknown path "+url.path}
+        if "school" not in arguments:
+            return 400, {"error": "The query needs a school"}
+
+        percentiles = None
+        if "percentiles" in arguments:
+            try:
+                percentiles = [int(p) for p in arguments["percentiles"][0].split(",")]
+            except ValueError:
+                return 400, {"error": "The percentiles must be whole numbers from 1 to 100"}
+        try:
+            return 200, self.query(arguments["school"][0], percentiles)
+        except InvalidArgumentError as e:
+            return 400, {"error": str(e)}
+        except KeyError:
+            return 404, {"error": "Did not find any data for "+arguments["school"][0]}
+
+    async def handle(self, reader, writer):
+        """Serves the requests of one connection, keeping it open between requests unless the client asks otherwise"""
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                parts = request.decode("latin-1").split()
+                if len(parts) != 3 or parts[0] != "GET":
+                    status, result = 405, {"error": "Only GET requests are served"}
+                else:
+                    status, result = self.answer(parts[1])
+
+                body = json.dumps(result).encode("utf-8")
+                keep_alive = headers.get("connection", "").lower() != "close" and len(parts) == 3 and parts[2] == "HTTP/1.1"
+                writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n"
+                              % (status, _REASONS.get(status, ""), len(body), "keep-alive" if keep_alive else "close")).encode("latin-1") + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def watch(self):
+        """Reads the files again, in a worker thread, whenever one of them changes"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.poll)
+            if self.changed():
+                try:
+                    await loop.run_in_executor(None, self.load)
+                except (FileError, InvalidArgumentError):
+                    #A file may be half written; we keep serving the old scores and try again later
+                    pass
+
+    async def start(self, host = "127.0.0.1", port = 8000, path = None):
+        """Starts listening on a Unix socket if path is given, otherwise on host:port. Returns the asyncio server"""
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle, path = path)
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def run(self, host = "127.0.0.1", port = 8000, path = None):
+        """Serves queries until the program is stopped"""
+        server = await self.start(host, port, path)
+        watcher = asyncio.ensure_future(self.watch())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+def serve(files, host = "127.0.0.1", port = 8000, path = None, jobs = 1, engine = "python", cache = None, poll = 2.0):
+    """Reads the files and serves queries about them until the program is stopped"""
+
+    server = ECDFServer(files, jobs, engine, cache, poll = poll)
+    try:
+        asyncio.run(server.run(host, port, path))
+    except KeyboardInterrupt:
+        pass
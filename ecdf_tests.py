@@ -3,11 +3,18 @@
 I have decided to have four main functions in the program: parseArg, getData, makeECDF, printECDF. ParseArg will take the arguments provided by the user and parse them to make sure that they are valid. GetData will then take those arguments and scan through the selected files for the relevant information. MakeECDF will then take that data and return the ECDF in a compact form. PrintECDF will take the ECDF provided by MakeECDF and return a string that is in the correct format."""
 
 from ecdf import *
+import os
 import unittest
 
 pandas_imported = False #this will check if Pandas was imported
+numpy_imported = False
 try:
     import numpy as np #note that np.percentile requires numpy 1.9.0 or later
+    numpy_imported = True
+except ImportError:
+    print("Could not load NumPy. Will not be able to test the numpy engine")
+
+try:
     import pandas as pd
     pandas_imported = True
 except ImportError:
@@ -53,6 +60,33 @@ class TestParseArg(unittest.TestCase):
         result = parseArg(["ecdf.py", "--school","Port Chester University",'file1.csv',"file2.csv", "file3.txt"]) 
         self.assertEqual(("Port Chester University", ["file1.csv", "file2.csv", "file3.txt"]), result)
 
+    def test_all_schools(self):
+        """--all-schools takes no school name, and returns None in its place"""
+        result = parseArg(["ecdf.py", "--all-schools",'file1.csv',"file2.csv"]) 
+        self.assertEqual((None, ["file1.csv", "file2.csv"]), result)
+        self.assertRaises(InvalidArgumentError, parseArg, ["ecdf.py", "--all-schools"])
+
+
+
+class TestParseOptions(unittest.TestCase):
+    """parseOptions should take the optional arguments out and leave the rest for parseArg"""
+
+    def test_no_options(self):
+        """without options, the arguments are unchanged"""
+        argv = ["ecdf.py", "--school","Port Chester University",'file1.csv']
+        self.assertEqual(({}, argv), parseOptions(argv))
+
+    def test_jobs(self):
+        """--jobs takes an integer"""
+        result = parseOptions(["ecdf.py", "--jobs", "4", "--school","Port Chester University",'file1.csv'])
+        self.assertEqual(({"jobs": 4}, ["ecdf.py", "--school","Port Chester University",'file1.csv']), result)
+        result = parseOptions(["ecdf.py", "--engine", "numpy", "--jobs", "2", "--all-schools", 'file1.csv'])
+        self.assertEqual(({"jobs": 2, "engine": "numpy"}, ["ecdf.py", "--all-schools", 'file1.csv']), result)
+        result = parseOptions(["ecdf.py", "--no-cache", "--cache-dir", "/tmp/ecdf", "--school", "ABC", 'file1.csv'])
+        self.assertEqual(({"no_cache": True, "cache_dir": "/tmp/ecdf"}, ["ecdf.py", "--school", "ABC", 'file1.csv']), result)
+        self.assertRaises(InvalidArgumentError, parseOptions, ["ecdf.py", "--jobs", "four", "--school", "ABC", "file1.csv"])
+        self.assertRaises(InvalidArgumentError, parseOptions, ["ecdf.py", "--school", "ABC", "file1.csv", "--jobs"])
+        self.assertRaises(InvalidArgumentError, parseOptions, "string")
 
 
 class TestGetData(unittest.TestCase):
@@ -121,6 +155,437 @@ class TestGetData(unittest.TestCase):
         self.assertEqual([75.5], result)
         
 
+class TestParallelGetData(unittest.TestCase):
+    """Reading the files with several worker processes must give exactly the serial result"""
+
+    big_files = ["test_data/big1.csv","test_data/big2.csv","test_data/big3.csv","test_data/big4.csv"]
+
+    def test_bad_jobs(self):
+        """the number of jobs must be a positive integer"""
+        self.assertRaises(InvalidArgumentError, getData, "ABC University", self.big_files, 0)
+        self.assertRaises(InvalidArgumentError, getData, "ABC University", self.big_files, "2")
+        self.assertRaises(InvalidArgumentError, getAllData, self.big_files, -1)
+
+    def test_same_as_serial(self):
+        """checking getData and getAllData over the four big files"""
+        self.assertEqual(getData("ABC University", self.big_files), getData("ABC University", self.big_files, 3))
+        self.assertEqual(getAllData(self.big_files), getAllData(self.big_files, 2))
+
+    def test_fractional_scores(self):
+        """scores that are not integers are added up in the order of the files, as one running sum per student, by every reader"""
+        import random, tempfile, shutil
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        rng = random.Random(7)
+        files = []
+        scores = {}
+        for number in range(3):
+            files.append(os.path.join(directory, "part%d.csv" % number))
+            with open(files[-1], "w") as f:
+                for i in range(3000):
+                    student_id, school, score = rng.randrange(40), rng.choice(["ABC University", "XYZ University"]), rng.uniform(0, 100)
+                    f.write("%d,Math,%s,2015-01-01,%r\n" % (student_id, school, score))
+                    scores.setdefault(school, {}).setdefault(student_id, []).append(score)
+
+        #The averages of the original program, which summed the list of scores of each student
+        expected = dict((school, sorted([sum(s)/len(s) for s in scores[school].values()])) for school in scores)
+        readers = [{}, {"jobs": 2}, {"strict": False}, {"strict": False, "jobs": 2}, {"cache": ParseCache(directory)}, {"cache": ParseCache(directory), "jobs": 3}, {"index": FileIndex(directory), "strict": False}]
+        if numpy_imported:
+            readers += [{"engine": "numpy"}, {"engine": "numpy", "jobs": 2}, {"engine": "numpy", "cache": ParseCache(directory)}]
+        for reader in readers:
+            self.assertEqual(expected["ABC University"], getData("ABC University", files, **reader), reader)
+            reader.pop("strict", None)
+            self.assertEqual(expected, getAllData(files, **reader), reader)
+
+        snapshot = Snapshot()
+        for this_file in files:
+            snapshot.update([this_file])
+        self.assertEqual(expected["XYZ University"], snapshot.aggregates["XYZ University"].means())
+
+    def test_error_names_file(self):
+        """a malformed file must still be named in the error"""
+        try:
+            getData("ABC University", ["test_data/big1.csv", "test_data/bad3.csv"], 2)
+        except FileError as e:
+            self.assertTrue("test_data/bad3.csv" in str(e))
+        else:
+            self.fail("FileError not raised")
+
+
+class TestPrefilter(unittest.TestCase):
+    """Reading only the lines that contain the name of the school must give exactly the strict results"""
+
+    big_files = ["test_data/big1.csv","test_data/big2.csv","test_data/big3.csv","test_data/big4.csv"]
+
+    def write(self, lines):
+        import tempfile, shutil
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "lines.csv")
+        with open(path, "w") as f:
+            f.write("\n".join(lines))
+        return path
+
+    def test_same_results(self):
+        """every school of the big files, in serial and in parallel"""
+        for school in getAllData(self.big_files):
+            self.assertEqual(getData(school, self.big_files), getData(school, self.big_files, 2, strict = False))
+
+    def test_lookalike_names(self):
+        """the name of the school may be quoted, be part of a longer name or appear in another field"""
+        path = self.write(['1,Math,"ABC University",2015-01-01,10', '2,Math,ABC University East,2015-01-01,20', '3,ABC University,XYZ University,2015-01-01,30',
+                           '1,Math,ABC University,2015-01-01,40', '4,Math,ABC University,2015-01-01,50'])
+        self.assertEqual([25.0, 50.0], getData("ABC University", [path], strict = False))
+        self.assertEqual([20.0], getData("ABC University East", [path], strict = False))
+        self.assertEqual(getData("XYZ University", [path]), getData("XYZ University", [path], strict = False))
+
+    def test_strict(self):
+        """malformed lines of other schools are only noticed in strict mode, those of the school always are"""
+        path = self.write(['1,Math,ABC University,2015-01-01,10', 'two,Math,XYZ University,2015-01-01,20'])
+        self.assertEqual([10.0], getData("ABC University", [path], strict = False))
+        self.assertRaises(FileError, getData, "ABC University", [path])
+        self.assertRaises(FileError, getData, "XYZ University", [path], strict = False)
+        self.assertRaises(FileError, getData, "ABC University", ["not_a_file.csv"], strict = False)
+
+
+class TestRowFilter(unittest.TestCase):
+    """Filtering by course and date must give the same results with every reader"""
+
+    def setUp(self):
+        import tempfile, shutil
+        from makeData import makeData
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.files = [os.path.join(self.directory, name) for name in ["one.csv", "two.csv"]]
+        for seed, path in enumerate(self.files):
+            makeData(path, 20000, 4, 50, seed = seed)
+            #The index pays off on files written in date order
+            with open(path) as f:
+                lines = sorted(f, key = lambda line: line.split(",")[3])
+            with open(path, "w") as f:
+                f.writelines(lines)
+
+    def expected(self, school, course, start, end):
+        """The sorted averages, computed straight from the lines"""
+        scores = {}
+        for path in self.files:
+            with open(path) as f:
+                for line in f:
+                    fields = line.strip().split(",")
+                    if fields[2] == school and (course is None or fields[1] == course) and (start is None or fields[3] >= start) and (end is None or fields[3][:len(end)] <= end):
+                        scores.setdefault(int(fields[0]), []).append(float(fields[4]))
+        return sorted([sum(s)/len(s) for s in scores.values()])
+
+    def test_bad_filters(self):
+        """bad courses and dates are rejected"""
+        self.assertRaises(InvalidArgumentError, RowFilter, 3)
+        self.assertRaises(InvalidArgumentError, RowFilter, None, "March")
+        self.assertRaises(InvalidArgumentError, RowFilter, None, "2015-3-1")
+        self.assertRaises(InvalidArgumentError, RowFilter, None, "2015-05", "2015-03-31")
+        self.assertRaises(InvalidArgumentError, getData, "ABC University", self.files, where = "Math")
+
+    def test_same_results(self):
+        """every reader gives the averages of the matching lines"""
+        readers = [{}, {"strict": False}, {"jobs": 2}, {"cache": ParseCache(self.directory)}, {"index": FileIndex(self.directory), "strict": False}]
+        if numpy_imported:
+            readers += [{"engine": "numpy"}, {"engine": "numpy", "cache": ParseCache(self.directory)}, {"engine": "numpy", "index": FileIndex(self.directory), "strict": False}]
+        for course, start, end in [("Math", None, None), (None, "2015-03", "2015-05"), ("Latin", "2015-02-14", "2015-02-20"), (None, None, "2015-01"), ("Art", "2015", None)]:
+            expected = self.expected("ABC University", course, start, end)
+            for reader in readers + readers[3:]:
+                self.assertEqual(expected, getData("ABC University", self.files, where = RowFilter(course, start, end), **reader))
+        self.assertRaises(FileError, getData, "ABC University", self.files, where = RowFilter("Dance"))
+
+        where = RowFilter("Math", "2015-06")
+        all_data = getAllData(self.files, where = where)
+        self.assertEqual(all_data, getAllData(self.files, where = where, index = FileIndex(self.directory), strict = False))
+        for school in all_data:
+            self.assertEqual(self.expected(school, "Math", "2015-06", None), all_data[school])
+
+    def test_index(self):
+        """the index skips the blocks that cannot match, and is made again when the file changes"""
+        index = FileIndex(self.directory)
+        engines = ["python", "numpy"] if numpy_imported else ["python"]
+        for engine in engines:
+            stats = Stats()
+            getData("ABC University", self.files, engine = engine, where = RowFilter(None, "2015-03", "2015-03"), stats = stats, index = index, strict = False)
+            for path in self.files:
+                self.assertTrue(stats.files[path]["rows"] < 20000 / 4)
+                self.assertTrue(index.load(path) is not None)
+
+        with open(self.files[0], "a") as f:
+            f.write("1,Math,ABC University,2015-03-01,100\n")
+        self.assertTrue(index.load(self.files[0]) is None)
+        for engine in engines:
+            self.assertEqual(self.expected("ABC University", None, "2015-03", "2015-03"), getData("ABC University", self.files, engine = engine, where = RowFilter(None, "2015-03", "2015-03"), index = index, strict = False))
+
+    def test_index_strict(self):
+        """a strict read checks every line even with an index, and the command line does not take both"""
+        path = os.path.join(self.directory, "bad.csv")
+        with open(path, "w") as f:
+            f.write("two,Math,XYZ University,2015-06-01,20\n" + "2,Math,XYZ University,2015-06-01,20\n" * 5000 + "1,Math,ABC University,2015-01-01,10\n" * 5000)
+        index = FileIndex(self.directory)
+        self.assertEqual([10.0], getData("ABC University", [path], index = index, strict = False))
+        self.assertRaises(FileError, getData, "ABC University", [path], index = index)
+        self.assertRaises(FileError, getAllData, [path], index = index)
+        self.assertRaises(InvalidArgumentError, main, ["ecdf.py", "--index", "--strict", "--cache-dir", self.directory, "--school", "ABC University", path])
+
+    def test_index_eviction(self):
+        """indexes count towards the size of the cache directory, and the least recently used ones are deleted"""
+        import ecdf
+        cache = os.path.join(self.directory, "cache")
+        index = FileIndex(cache)
+        getData("ABC University", self.files[:1], index = index, strict = False)
+        first = index._path(self.files[0])
+        os.utime(first, (0, 0))
+        index.max_size = int(os.path.getsize(first) * 1.5)
+        getData("ABC University", self.files[1:], index = index, strict = False)
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(index._path(self.files[1])))
+
+        ParseCache(cache, 0).store(self.files[0], ecdf._parseColumns(self.files[0]))
+        self.assertEqual([], os.listdir(cache))
+
+    def test_main(self):
+        """filters cannot be used with a snapshot"""
+        self.assertRaises(InvalidArgumentError, main, ["ecdf.py", "--course", "Math", "--snapshot", os.path.join(self.directory, "state.snap"), "--all-schools"])
+
+
+class TestCompressedInput(unittest.TestCase):
+    """Compressed files must give exactly the results of the files they were made from"""
+
+    big_files = ["test_data/big1.csv","test_data/big2.csv"]
+
+    def setUp(self):
+        import gzip, bz2, lzma, tempfile, shutil
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.compressed = {}
+        for suffix, module in [(".gz", gzip), (".bz2", bz2), (".xz", lzma)]:
+            self.compressed[suffix] = []
+            for this_file in self.big_files:
+                path = os.path.join(self.directory, os.path.basename(this_file) + suffix)
+                with open(this_file, "rb") as f, module.open(path, "wb") as out:
+                    out.write(f.read())
+                self.compressed[suffix].append(path)
+
+    def test_same_results(self):
+        """every compression, engine and the cache give the results of the plain files"""
+        engines = ["python", "numpy"] if numpy_imported else ["python"]
+        expected = getAllData(self.big_files)
+        for suffix, files in self.compressed.items():
+            self.assertEqual(getData("ABC University", self.big_files), getData("ABC University", files))
+            for engine in engines:
+                self.assertEqual(expected, getAllData(files, 2, engine))
+            cache = ParseCache(self.directory)
+            self.assertEqual(expected, getAllData(files, cache = cache))
+            self.assertEqual(expected, getAllData(files, cache = cache))
+
+        #gzip files can be concatenated
+        joined = os.path.join(self.directory, "joined.csv.gz")
+        with open(joined, "wb") as out:
+            for path in self.compressed[".gz"]:
+                with open(path, "rb") as f:
+                    out.write(f.read())
+        self.assertEqual(expected, getAllData([joined]))
+
+    def test_bad_files(self):
+        """a corrupt or truncated file raises a FileError naming it, and other suffixes are still rejected"""
+        corrupt = os.path.join(self.directory, "corrupt.csv.gz")
+        with open(corrupt, "wb") as f:
+            f.write(b"not gzip data at all")
+        truncated = os.path.join(self.directory, "truncated.csv.xz")
+        with open(self.compressed[".xz"][0], "rb") as f:
+            data = f.read()
+        with open(truncated, "wb") as f:
+            f.write(data[:len(data)//2])
+        for bad in [corrupt, truncated]:
+            try:
+                getAllData([bad])
+            except FileError as e:
+                self.assertTrue(bad in str(e))
+            else:
+                self.fail("FileError not raised")
+        self.assertRaises(FileError, getAllData, [self.big_files[0] + ".zip"])
+        self.assertRaises(FileError, getAllData, [os.path.join(self.directory, "missing.csv.gz")])
+
+
+class TestStats(unittest.TestCase):
+    """Recording the stages of a run must not change its results"""
+
+    big_files = ["test_data/big1.csv","test_data/big2.csv"]
+
+    def test_same_results(self):
+        """getData, getAllData and makeECDF give the same answers with and without a Stats"""
+        stats = Stats()
+        data = getData("ABC University", self.big_files, stats = stats)
+        self.assertEqual(getData("ABC University", self.big_files), data)
+        self.assertEqual(makeECDF(data), makeECDF(data, stats = stats))
+        parallel = Stats()
+        self.assertEqual(getAllData(self.big_files), getAllData(self.big_files, 2, stats = parallel))
+        for stage in ["read", "parse", "average", "check", "select"]:
+            self.assertTrue(stage in stats.stages, stage)
+        self.assertTrue("merge" in parallel.stages)
+
+    def test_rows_and_hooks(self):
+        """every row of every file is counted, also when they are read by worker processes, and the hooks see every stage"""
+        calls = []
+        stats = Stats()
+        stats.addHook(lambda stage, wall, cpu: calls.append(stage))
+        getAllData(self.big_files, 2, stats = stats)
+        for this_file in self.big_files:
+            with open(this_file) as f:
+                self.assertEqual(len(f.readlines()), stats.files[this_file]["rows"])
+            self.assertEqual(stats.files[this_file]["rows"], stats.files[this_file]["matched"])
+        self.assertEqual(set(stats.stages), set(calls))
+
+        report = stats.report()
+        self.assertEqual(report["schools"], len(getAllData(self.big_files)))
+        self.assertTrue(report["stages"]["parse"]["wall"] >= 0)
+
+    def test_main(self):
+        """--stats-json saves the report without changing what is printed"""
+        import io, json, tempfile, shutil, contextlib
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        printed = []
+        for extra in [["--no-cache"], ["--no-cache", "--strict", "--stats-json", os.path.join(directory, "strict.json")], ["--no-cache", "--stats-json", os.path.join(directory, "prefiltered.json")]]:
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                main(["ecdf.py"] + extra + ["--school", "ABC University"] + self.big_files)
+            printed.append(out.getvalue())
+        self.assertEqual(printed[0], printed[1])
+        self.assertEqual(printed[0], printed[2])
+        with open("test_data/big1.csv") as f:
+            rows = len(f.readlines())
+        for name in ["strict.json", "prefiltered.json"]:
+            with open(os.path.join(directory, name)) as f:
+                report = json.load(f)
+            self.assertTrue("output" in report["stages"])
+            self.assertEqual(rows, report["files"]["test_data/big1.csv"]["rows"])
+            self.assertTrue(report["files"]["test_data/big1.csv"]["matched"] < rows)
+
+
+@unittest.skipIf(not numpy_imported, "the numpy engine needs NumPy")
+class TestNumpyEngine(unittest.TestCase):
+    """The numpy engine must give exactly the results of the python engine, and reject the same files"""
+
+    big_files = ["test_data/big1.csv","test_data/big2.csv","test_data/big3.csv","test_data/big4.csv"]
+
+    def test_bad_engine(self):
+        """only the known engines are accepted"""
+        self.assertRaises(InvalidArgumentError, getData, "ABC University", self.big_files, 1, "pandas")
+        self.assertRaises(InvalidArgumentError, getAllData, self.big_files, 1, None)
+
+    def test_bad_files(self):
+        """the same validation rules apply"""
+        for bad in ["test_data/bad1.csv", "test_data/bad3.csv", "test_data/bad4.csv", "not_a_file.csv"]:
+            self.assertRaises(FileError, getData, "ABC University", [bad], 1, "numpy")
+
+    def test_small_files(self):
+        """the quotes around the school names are stripped"""
+        result = getData("ABC University", ['test_data/file1.csv',"test_data/file2.csv"], 1, "numpy")
+        self.assertEqual([55.0, 62.5, 83.5], result)
+        self.assertEqual(getAllData(['test_data/file1.csv',"test_data/file2.csv"]), getAllData(['test_data/file1.csv',"test_data/file2.csv"], 1, "numpy"))
+        self.assertEqual(getAllData(["test_data/weird.csv"]), getAllData(["test_data/weird.csv"], 1, "numpy"))
+
+    def write(self, text):
+        import tempfile, shutil
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "lines.csv")
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_edge_cases(self):
+        """a score of -0 stays -0.0, and a last line of spaces is rejected, as with the python engine"""
+        import math
+        path = self.write("1,Math,ABC University,2015-01-01,-0\n2,Math,ABC University,2015-01-01,-0.0\n2,Math,ABC University,2015-01-01,-0.0\n3,Math,ABC University,2015-01-01,5")
+        for engine in ["python", "numpy"]:
+            means = getData("ABC University", [path], engine = engine, sort = False)
+            self.assertEqual([-1.0, -1.0, 1.0], sorted([math.copysign(1.0, mean) for mean in means]), engine)
+        path = self.write("1,Math,ABC University,2015-01-01,10\n   ")
+        for engine in ["python", "numpy"]:
+            self.assertRaises(FileError, getData, "ABC University", [path], engine = engine)
+
+    def test_large_ids(self):
+        """ids beyond 64 bits are read by the python engine, also through the cache, and rejected with a clear error by the numpy engine"""
+        path = self.write("%d,Math,ABC University,2015-01-01,10\n1,Math,ABC University,2015-01-01,20\n" % 2**70)
+        cache = ParseCache(os.path.join(os.path.dirname(path), "cache"))
+        self.assertEqual([10.0, 20.0], getData("ABC University", [path]))
+        self.assertEqual([10.0, 20.0], getData("ABC University", [path], cache = cache))
+        self.assertEqual(None, cache.load(path))
+        for reader in [{"engine": "numpy"}, {"engine": "numpy", "cache": cache}]:
+            try:
+                getData("ABC University", [path], **reader)
+            except FileError as e:
+                self.assertTrue("64 bits" in str(e))
+            else:
+                self.fail("FileError not raised")
+        snapshot = Snapshot()
+        snapshot.update([path])
+        self.assertRaises(FileError, snapshot.save, os.path.join(os.path.dirname(path), "state.snap"))
+
+    def test_same_as_python(self):
+        """checking all schools over the four big files, with small chunks so that lines are split between chunks"""
+        import ecdf
+        chunk_size = ecdf.CHUNK_SIZE
+        ecdf.CHUNK_SIZE = 1000
+        try:
+            self.assertEqual(getAllData(self.big_files), getAllData(self.big_files, 1, "numpy"))
+            self.assertEqual(getData("XYZ University", self.big_files), getData("XYZ University", self.big_files, 2, "numpy"))
+        finally:
+            ecdf.CHUNK_SIZE = chunk_size
+
+    def test_snapshot(self):
+        """a snapshot updated by the numpy engine keeps StudentAggregates, also when a file is bad, and gives the results of the python engine"""
+        snapshot = Snapshot()
+        snapshot.update(self.big_files[:2])
+        self.assertRaises(FileError, snapshot.update, ["test_data/bad1.csv"], engine = "numpy")
+        snapshot.update(self.big_files[2:], engine = "numpy")
+        self.assertTrue(all([type(aggregate) is StudentAggregate for aggregate in snapshot.aggregates.values()]))
+        expected = getAllData(self.big_files)
+        self.assertEqual(expected, dict((school, snapshot.aggregates[school].means()) for school in expected))
+
+
+class TestStudentAggregate(unittest.TestCase):
+    """The aggregate should keep one running sum and count per student"""
+
+    def test_means(self):
+        """checking the averages of a few students"""
+        aggregate = StudentAggregate()
+        for student_id, score in [(1, 90.0), (2, 10.0), (1, 20.0), (3, 35.0), (2, 45.0)]:
+            aggregate.add(student_id, score)
+        self.assertEqual(3, len(aggregate))
+        self.assertEqual([27.5, 35.0, 55.0], aggregate.means())
+        self.assertEqual([2, 2, 1], list(aggregate.counts))
+
+
+class TestGetAllData(unittest.TestCase):
+    """getAllData should give, for every school, the same answer as getData"""
+
+    def test_wrong_type_of_arguments(self):
+        """testing to make sure it only accepts a list of .csv files"""
+        self.assertRaises(InvalidArgumentError, getAllData, "string")
+        self.assertRaises(InvalidArgumentError, getAllData, [1,"string"])
+        self.assertRaises(FileError, getAllData, ["file1.csv","file2.txt"])
+        self.assertRaises(FileError, getAllData, ["test_data/bad1.csv"])
+
+    def test_small_files(self):
+        """checking over two small csv files"""
+        result = getAllData(['test_data/file1.csv',"test_data/file2.csv"])
+        self.assertEqual(["ABC University", "DEF University", "GHI University", "Port Chester University"], sorted(result))
+        self.assertEqual([55.0, 62.5, 83.5], result["ABC University"])
+        self.assertEqual([75.5], result["Port Chester University"])
+
+    def test_matches_getData(self):
+        """every school should match the result of getData on the same files"""
+        files = ["test_data/big1.csv","test_data/big2.csv","test_data/big3.csv","test_data/big4.csv"]
+        result = getAllData(files)
+        for school in result:
+            self.assertEqual(getData(school, files), result[school])
+        
+
 class TestMakeECDF(unittest.TestCase):
     """I will divide my tests into two parts. First I will check that invalid arguments raise errors. Then I will check that valid arguments return correct output"""
 
@@ -156,6 +621,767 @@ class TestMakeECDF(unittest.TestCase):
 , result)
 
 
+class TestSelectECDF(unittest.TestCase):
+    """makeECDF on unsorted data must give exactly what it gives on the sorted data"""
+
+    def test_unsorted_small(self):
+        """the example from TestMakeECDF, unsorted"""
+        data = [0.4,0.55,0.7,0.85, 1.97,3.77, -4.5, -2]
+        self.assertEqual(makeECDF(sorted(data)), makeECDF(data, presorted = False))
+        self.assertEqual([7], makeECDF([7], presorted = False)[:1])
+        self.assertRaises(InvalidArgumentError, makeECDF, [], False)
+
+    def test_unsorted_big(self):
+        """checking the means of the big files, in the order getData leaves them with sort = False"""
+        files = ["test_data/big1.csv","test_data/big2.csv","test_data/big3.csv","test_data/big4.csv"]
+        data = getData("DEF University", files, sort = False)
+        self.assertEqual(getData("DEF University", files), sorted(data))
+        self.assertEqual(makeECDF(sorted(data)), makeECDF(data, presorted = False))
+
+    def test_trusted(self):
+        """with check = False the sorting is not checked"""
+        self.assertEqual(3, makeECDF([3,2], check = False)[0])
+
+
+class TestQuantileGrid(unittest.TestCase):
+    """Other quantiles and methods must give what np.quantile gives"""
+
+    def test_bad_arguments(self):
+        """unknown methods and quantiles outside 0..1 are rejected"""
+        self.assertRaises(InvalidArgumentError, makeECDF, [1, 2], method = "higher")
+        self.assertRaises(InvalidArgumentError, makeECDF, [1, 2], quantiles = [0.5, 1.5])
+        self.assertRaises(InvalidArgumentError, makeECDF, [1, 2], quantiles = [])
+        self.assertRaises(InvalidArgumentError, makeECDF, [1, 2], quantiles = "0.5")
+        self.assertRaises(InvalidArgumentError, main, ["ecdf.py", "--method", "linear", "--approx", "0.01", "--all-schools", "test_data/big1.csv"])
+
+    def test_small(self):
+        """the four methods on four scores"""
+        data = [1.0, 2.0, 3.0, 4.0]
+        for method, expected in [("lower", [1.0, 2.0, 4.0]), ("linear", [1.0, 2.5, 4.0]), ("nearest", [1.0, 3.0, 4.0]), ("midpoint", [1.0, 2.5, 4.0])]:
+            self.assertEqual(expected, makeECDF(data, quantiles = [0, 0.5, 1], method = method))
+            self.assertEqual(expected, makeECDF([3.0, 1.0, 4.0, 2.0], presorted = False, quantiles = (0, 0.5, 1), method = method))
+        self.assertEqual(makeECDF(data), makeECDF(data, method = "lower"))
+
+    @unittest.skipIf(not numpy_imported, "np.quantile needs NumPy")
+    def test_numpy(self):
+        """every method, on the means of the big files"""
+        files = ["test_data/big1.csv","test_data/big2.csv","test_data/big3.csv","test_data/big4.csv"]
+        data = getData("DEF University", files, sort = False)
+        grids = [None, [i/10 for i in range(11)], np.linspace(0, 1, 1001)]
+        for method in METHODS:
+            for grid in grids:
+                expected = np.quantile(data, [i/100 for i in range(100)] if grid is None else grid, method = method).tolist()
+                if grid is not None or method != "lower":
+                    self.assertEqual(expected, makeECDF(data, presorted = False, quantiles = grid, method = method))
+                self.assertEqual(makeECDF(sorted(data), quantiles = grid, method = method), makeECDF(data, presorted = False, quantiles = grid, method = method))
+
+
+class TestParseCache(unittest.TestCase):
+    """Files read through the cache must give the same results as files parsed directly, and changed files must be parsed again"""
+
+    big_files = ["test_data/big1.csv","test_data/big2.csv","test_data/big3.csv","test_data/big4.csv"]
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+        self.cache = ParseCache(os.path.join(self.directory, "cache"))
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def sidecars(self):
+        return sorted([name for name in os.listdir(self.cache.directory) if name.endswith(ParseCache.SUFFIX)])
+
+    def test_same_results(self):
+        """a miss and then a hit, for both engines"""
+        expected = getAllData(self.big_files)
+        self.assertEqual(expected, getAllData(self.big_files, cache = self.cache))
+        self.assertEqual(4, len(self.sidecars()))
+        self.assertEqual(expected, getAllData(self.big_files, cache = self.cache))
+        self.assertEqual(getData("ABC University", self.big_files), getData("ABC University", self.big_files, 2, cache = self.cache))
+        self.assertEqual([55.0, 62.5, 83.5], getData("ABC University", ['test_data/file1.csv',"test_data/file2.csv"], cache = self.cache))
+        self.assertEqual([55.0, 62.5, 83.5], getData("ABC University", ['test_data/file1.csv',"test_data/file2.csv"], cache = self.cache))
+        self.assertRaises(FileError, getData, "XYZ University", ['test_data/file1.csv'], cache = self.cache)
+        if numpy_imported:
+            self.assertEqual(expected, getAllData(self.big_files, engine = "numpy", cache = self.cache))
+            self.assertEqual(getData("ABC University", self.big_files), getData("ABC University", self.big_files, engine = "numpy", cache = self.cache))
+
+    @unittest.skipIf(not numpy_imported, "the numpy engine needs NumPy")
+    def test_numpy_miss(self):
+        """a miss of the numpy engine is parsed with NumPy into the same columns, and hashed while it is read"""
+        import shutil
+        expected = getAllData(self.big_files)
+        self.assertEqual(expected, getAllData(self.big_files, engine = "numpy", cache = self.cache))
+        self.assertEqual(4, len(self.sidecars()))
+        self.assertEqual(expected, getAllData(self.big_files, cache = self.cache))
+
+        copy = os.path.join(self.directory, "copy.csv")
+        shutil.copy(self.big_files[0], copy)
+        getData("ABC University", [copy], engine = "numpy", cache = self.cache)
+        os.utime(copy, (1, 1))
+        self.assertNotEqual(None, self.cache.load(copy))
+        for bad in ["test_data/bad1.csv", "test_data/bad3.csv", "test_data/bad4.csv"]:
+            self.assertRaises(FileError, getData, "ABC University", [bad], engine = "numpy", cache = self.cache)
+        self.assertEqual(5, len(self.sidecars()))
+
+    def test_bad_files(self):
+        """the same validation rules apply, and nothing is cached"""
+        for bad in ["test_data/bad1.csv", "test_data/bad3.csv", "test_data/bad4.csv", "not_a_file.csv"]:
+            self.assertRaises(FileError, getData, "ABC University", [bad], cache = self.cache)
+        self.assertFalse(os.path.isdir(self.cache.directory))
+
+    def test_changed_file(self):
+        """a file with new content is parsed again, a file that was only touched is not"""
+        this_file = os.path.join(self.directory, "scores.csv")
+        with open(this_file, "w") as f:
+            f.write('1,"Math","ABC University",2015-04-16,90.0\n')
+        self.assertEqual([90.0], getData("ABC University", [this_file], cache = self.cache))
+
+        with open(this_file, "w") as f:
+            f.write('1,"Math","ABC University",2015-04-16,80.0\n')
+        os.utime(this_file, (0, 0))
+        self.assertEqual([80.0], getData("ABC University", [this_file], cache = self.cache))
+
+        os.utime(this_file, (1, 1))
+        self.assertNotEqual(None, self.cache.load(this_file))
+        self.assertEqual([80.0], getData("ABC University", [this_file], cache = self.cache))
+
+    def test_damaged_sidecars(self):
+        """a sidecar that is cut short or has a bad header is a miss and is written again, and a failed write leaves no file behind"""
+        import ecdf, json, struct
+        from unittest import mock
+        expected = getData("ABC University", self.big_files[:1])
+        getData("ABC University", self.big_files[:1], cache = self.cache)
+        sidecar = self.cache._path(self.big_files[0])
+        with open(sidecar, "rb") as f:
+            content = f.read()
+        start = len(ParseCache.MAGIC) + 8
+        header = json.loads(content[start:start + struct.unpack("<Q", content[len(ParseCache.MAGIC):start])[0]].decode("utf-8"))
+        broken = [b"", content[:12], content[:start + 5], content[:len(content)//2]]
+        for key, value in [("rows", None), ("rows", -1), ("schools", "ABC University"), ("size", None)]:
+            changed = json.dumps(dict(header, **{key: value})).encode("utf-8")
+            broken.append(ParseCache.MAGIC + struct.pack("<Q", len(changed)) + changed)
+        changed = json.dumps(dict((key, header[key]) for key in header if key != "hash")).encode("utf-8")
+        broken.append(ParseCache.MAGIC + struct.pack("<Q", len(changed)) + changed)
+        for content in broken:
+            with open(sidecar, "wb") as f:
+                f.write(content)
+            self.assertEqual(None, self.cache.load(self.big_files[0]))
+            self.assertEqual(expected, getData("ABC University", self.big_files[:1], cache = self.cache))
+            self.assertNotEqual(None, self.cache.load(self.big_files[0]))
+
+        self.cache.clear()
+        with mock.patch.object(ecdf._Columns, "write", side_effect = OSError("disk full")):
+            self.assertEqual(expected, getData("ABC University", self.big_files[:1], cache = self.cache))
+        self.assertEqual([], os.listdir(self.cache.directory))
+
+    def test_code_rows(self):
+        """the rows of a school are found in the column of codes, also when the bytes of two codes look like the code"""
+        import ecdf
+        from array import array
+        self.assertEqual([2, 4], list(ecdf._codeRows(array("i", [256, 0, 1, 7, 1]), 1)))
+        self.assertEqual([], list(ecdf._codeRows(array("i", []), 1)))
+
+    def test_command_line(self):
+        """the program only caches files when --cache or --cache-dir is given"""
+        import io, contextlib
+        from unittest import mock
+        home = os.path.join(self.directory, "home")
+        with mock.patch.dict(os.environ, {"HOME": home}), contextlib.redirect_stdout(io.StringIO()):
+            main(["ecdf.py", "--school", "ABC University"] + self.big_files[:1])
+            self.assertFalse(os.path.exists(home))
+            main(["ecdf.py", "--cache-dir", self.cache.directory, "--no-cache", "--school", "ABC University"] + self.big_files[:1])
+            self.assertFalse(os.path.exists(self.cache.directory))
+            main(["ecdf.py", "--cache", "--school", "ABC University"] + self.big_files[:1])
+            self.assertEqual(1, len(os.listdir(os.path.join(home, ".cache", "ecdf"))))
+            main(["ecdf.py", "--cache-dir", self.cache.directory, "--school", "ABC University"] + self.big_files[:1])
+            self.assertEqual(1, len(self.sidecars()))
+
+    def test_eviction_and_clear(self):
+        """the least recently used sidecars are deleted when the cache is full"""
+        getData("ABC University", self.big_files[:2], cache = self.cache)
+        first = self.cache._path(self.big_files[0])
+        os.utime(first, (0, 0))
+        self.cache.max_size = int(os.path.getsize(first) * 2.5)
+        getData("ABC University", self.big_files[2:3], cache = self.cache)
+        self.assertEqual(2, len(self.sidecars()))
+        self.assertFalse(os.path.exists(first))
+        self.cache.clear()
+        self.assertEqual([], self.sidecars())
+
+
+class TestSnapshot(unittest.TestCase):
+    """A snapshot updated with new files must give the same results as reading all the files at once"""
+
+    big_files = ["test_data/big1.csv","test_data/big2.csv","test_data/big3.csv","test_data/big4.csv"]
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def means(self, snapshot):
+        return dict((school, snapshot.aggregates[school].means()) for school in snapshot.aggregates)
+
+    def test_incremental(self):
+        """a snapshot of two files, saved, loaded and updated with the other two"""
+        path = os.path.join(self.directory, "state.snap")
+        snapshot = Snapshot()
+        self.assertEqual(self.big_files[:2], snapshot.update(self.big_files[:2]))
+        snapshot.save(path)
+
+        snapshot = Snapshot.load(path)
+        self.assertEqual(self.big_files[2:], snapshot.update(self.big_files))
+        self.assertEqual([], snapshot.update(self.big_files))
+        self.assertEqual(getAllData(self.big_files), self.means(snapshot))
+        self.assertEqual(4, len(snapshot.files))
+
+    def test_merge(self):
+        """merging the snapshots of two shards"""
+        first, second = Snapshot(), Snapshot()
+        first.update(self.big_files[:2])
+        second.update(self.big_files[2:], engine = "numpy" if numpy_imported else "python")
+        first.merge(second)
+        expected = getAllData(self.big_files)
+        result = self.means(first)
+        for school in expected:
+            self.assertEqual(len(expected[school]), len(result[school]))
+            for a, b in zip(expected[school], result[school]):
+                self.assertAlmostEqual(a, b)
+        self.assertRaises(InvalidArgumentError, first.merge, second)
+
+    def test_changed_file(self):
+        """a file that changed after it was added is an error"""
+        this_file = os.path.join(self.directory, "scores.csv")
+        with open(this_file, "w") as f:
+            f.write('1,"Math","ABC University",2015-04-16,90.0\n')
+        snapshot = Snapshot()
+        snapshot.update([this_file])
+        with open(this_file, "a") as f:
+            f.write('1,"Math","ABC University",2015-04-17,80.0\n')
+        self.assertRaises(FileError, snapshot.update, [this_file])
+
+    def test_bad_snapshot(self):
+        """only files written by save can be loaded"""
+        self.assertRaises(FileError, Snapshot.load, "not_a_file.snap")
+        self.assertRaises(FileError, Snapshot.load, "test_data/file1.csv")
+        self.assertRaises(FileError, Snapshot().update, ["test_data/bad1.csv"])
+
+    def test_damaged_snapshot(self):
+        """a truncated snapshot or one with a damaged header raises a FileError"""
+        import json, struct
+        path = os.path.join(self.directory, "state.snap")
+        snapshot = Snapshot()
+        snapshot.update(self.big_files[:1])
+        snapshot.save(path)
+        with open(path, "rb") as f:
+            content = f.read()
+        start = len(Snapshot.MAGIC) + 8
+        header = json.loads(content[start:start + struct.unpack("<Q", content[len(Snapshot.MAGIC):start])[0]].decode("utf-8"))
+        broken = [content[:len(Snapshot.MAGIC) + 3], content[:-8]]
+        for key, value in [("files", None), ("schools", None), ("files", [{"path": 1}]), ("schools", [["ABC University", -1]]), ("schools", [[1, 2, 3]])]:
+            changed = dict(header)
+            if value is None:
+                del changed[key]
+            else:
+                changed[key] = value
+            changed = json.dumps(changed).encode("utf-8")
+            broken.append(Snapshot.MAGIC + struct.pack("<Q", len(changed)) + changed)
+        broken.append(Snapshot.MAGIC + struct.pack("<Q", 2) + b"[]")
+        for content in broken:
+            with open(path, "wb") as f:
+                f.write(content)
+            self.assertRaises(FileError, Snapshot.load, path)
+
+    def test_byte_order(self):
+        """the columns of a snapshot are little-endian on every machine"""
+        import struct
+        path = os.path.join(self.directory, "state.snap")
+        snapshot = Snapshot()
+        snapshot.aggregates["ABC University"] = StudentAggregate.fromColumns([7], [1.5], [2])
+        snapshot.save(path)
+        with open(path, "rb") as f:
+            content = f.read()
+        self.assertEqual(struct.pack("<qdq", 7, 1.5, 2), content[-24:])
+        self.assertEqual([0.75], Snapshot.load(path).aggregates["ABC University"].means())
+
+    def test_parseArg_without_files(self):
+        """with a snapshot, no new files are needed"""
+        self.assertEqual(("ABC", []), parseArg(["ecdf.py", "--school", "ABC"], need_files = False))
+        self.assertEqual((None, []), parseArg(["ecdf.py", "--all-schools"], need_files = False))
+        self.assertRaises(InvalidArgumentError, parseArg, ["ecdf.py", "--school", "ABC"])
+
+
+class TestECDFWriter(unittest.TestCase):
+    """Every format must hold the same percentiles as printECDF"""
+
+    def setUp(self):
+        files = ["test_data/big1.csv","test_data/big2.csv"]
+        self.ecdfs = [(school, makeECDF(getData(school, files))) for school in ["ABC University", "XYZ University"]]
+
+    def write(self, out, format):
+        writer = ECDFWriter(out, format)
+        for school, ecdf in self.ecdfs:
+            writer.write(school, ecdf)
+        writer.close()
+
+    def test_bad_arguments(self):
+        """unknown formats and bad percentiles are rejected"""
+        import io
+        self.assertRaises(InvalidArgumentError, ECDFWriter, None, "xml")
+        self.assertRaises(InvalidArgumentError, ECDFWriter(io.StringIO()).write, "school", [3, 2])
+        self.assertRaises(InvalidArgumentError, ECDFWriter(io.StringIO()).write, None, self.ecdfs[0][1])
+
+    def test_text(self):
+        """the text format is what the program prints"""
+        import io
+        out = io.StringIO()
+        self.write(out, "text")
+        self.assertEqual("".join([printECDF(school, ecdf) + "\n" for school, ecdf in self.ecdfs]), out.getvalue())
+
+    def test_csv_and_jsonl(self):
+        """reading the csv and json lines back"""
+        import io, csv, json
+        out = io.StringIO()
+        self.write(out, "csv")
+        rows = list(csv.reader(io.StringIO(out.getvalue())))
+        self.assertEqual(["school", "percentile", "mean_test_score"], rows[0])
+        self.assertEqual(201, len(rows))
+        self.assertEqual([school for school, ecdf in self.ecdfs for i in range(100)], [row[0] for row in rows[1:]])
+        self.assertEqual([x for school, ecdf in self.ecdfs for x in ecdf], [float(row[2]) for row in rows[1:]])
+
+        out = io.StringIO()
+        self.write(out, "jsonl")
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(list(range(1, 101))*2, [record["percentile"] for record in records])
+        self.assertEqual([x for school, ecdf in self.ecdfs for x in ecdf], [record["mean_test_score"] for record in records])
+
+    @unittest.skipIf(not numpy_imported, "the npy format needs NumPy")
+    def test_npy(self):
+        """reading the npy file back"""
+        import tempfile, shutil
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "out.npy")
+            self.write(path, "npy")
+            table = np.load(path)
+            self.assertEqual([school for school, ecdf in self.ecdfs], list(table["school"]))
+            self.assertEqual(self.ecdfs[1][1], table["mean_test_score"][1].tolist())
+        finally:
+            shutil.rmtree(directory)
+
+    def test_quantiles(self):
+        """a grid of quantiles is labelled by quantile in every format, and on the command line"""
+        import io, csv, json, contextlib
+        files = ["test_data/big1.csv","test_data/big2.csv"]
+        quantiles = [0.9, 0.05, 0.5, 1.0]
+        ecdf = makeECDF(getData("ABC University", files), quantiles = quantiles, method = "linear")
+        self.assertEqual("ABC University students\n\nquantile\tmean_test_score\n" + "".join(["%s\t%s\n" % (q, x) for q, x in zip(quantiles, ecdf)]), printECDF("ABC University", ecdf, quantiles))
+        self.assertRaises(InvalidArgumentError, printECDF, "ABC University", ecdf)
+        self.assertRaises(InvalidArgumentError, printECDF, "ABC University", ecdf[:3], quantiles)
+        self.assertRaises(InvalidArgumentError, printECDF, "ABC University", sorted(ecdf), quantiles)
+
+        out = io.StringIO()
+        writer = ECDFWriter(out, "csv", quantiles)
+        writer.write("ABC University", ecdf)
+        writer.close()
+        self.assertEqual([["school", "quantile", "mean_test_score"]] + [["ABC University", str(q), str(x)] for q, x in zip(quantiles, ecdf)], list(csv.reader(io.StringIO(out.getvalue()))))
+        out = io.StringIO()
+        writer = ECDFWriter(out, "jsonl", quantiles)
+        writer.write("ABC University", ecdf)
+        writer.close()
+        self.assertEqual([{"school": "ABC University", "quantile": q, "mean_test_score": x} for q, x in zip(quantiles, ecdf)], [json.loads(line) for line in out.getvalue().splitlines()])
+        self.assertRaises(InvalidArgumentError, ECDFWriter(io.StringIO(), "text", quantiles).write, "ABC University", self.ecdfs[0][1])
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            main(["ecdf.py", "--no-cache", "--quantiles", "0.9,0.05,0.5,1", "--method", "linear", "--school", "ABC University"] + files)
+        self.assertEqual(printECDF("ABC University", ecdf, quantiles) + "\n", out.getvalue())
+        sketch = getSketch("ABC University", files, 0.001)
+        self.assertEqual(approxECDF(sketch)[50], approxECDF(sketch, [0.5])[0])
+        for bad in ["0.5,x", "1.5"]:
+            self.assertRaises(InvalidArgumentError, main, ["ecdf.py", "--no-cache", "--quantiles", bad, "--school", "ABC University"] + files)
+
+    def test_failed_query(self):
+        """a query that fails leaves the output file of an earlier run as it was"""
+        import tempfile, shutil
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "results.txt")
+        main(["ecdf.py", "--no-cache", "--output", path, "--school", "ABC University", "test_data/big1.csv"])
+        with open(path) as f:
+            expected = f.read()
+        snapshot = os.path.join(directory, "state.snap")
+        for argv in [["--format", "csv", "--school", "Nowhere University", "test_data/big1.csv"], ["--format", "csv", "--all-schools", "test_data/bad1.csv"],
+                     ["--approx", "0.01", "--school", "Nowhere University", "test_data/big1.csv"], ["--snapshot", snapshot, "--school", "Nowhere University", "test_data/big1.csv"]]:
+            self.assertRaises(FileError, main, ["ecdf.py", "--no-cache", "--output", path] + argv)
+            with open(path) as f:
+                self.assertEqual(expected, f.read())
+        self.assertRaises(InvalidArgumentError, main, ["ecdf.py", "--no-cache", "--output", path, "--format", "xml", "--school", "ABC University", "test_data/big1.csv"])
+
+
+class TestBatch(unittest.TestCase):
+    """Every query of a batch must write exactly what a run of the program for that query alone writes"""
+
+    def setUp(self):
+        import tempfile, shutil
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.queries = [{"school": "ABC University", "files": ["test_data/big1.csv", "test_data/big2.csv"]},
+                        {"files": ["test_data/big2.csv", "test_data/big3.csv"], "format": "csv"},
+                        {"school": "XYZ University", "files": ["test_data/big3.csv", "test_data/big1.csv"], "course": "Math", "method": "linear"},
+                        {"school": "XYZ University", "files": ["test_data/big1.csv", "test_data/big2.csv", "test_data/big3.csv"], "format": "jsonl", "quantiles": [0.25, 0.5, 0.75]}]
+        for number, query in enumerate(self.queries):
+            query["output"] = os.path.join(self.directory, "batch%d.out" % number)
+
+    def manifest(self, queries):
+        import json
+        path = os.path.join(self.directory, "manifest.json")
+        with open(path, "w") as f:
+            json.dump({"queries": queries}, f)
+        return path
+
+    def alone(self, query):
+        """The output of the program run for one query"""
+        path = os.path.join(self.directory, "alone.out")
+        argv = ["ecdf.py", "--no-cache", "--output", path, "--format", query.get("format", "text"), "--method", query.get("method", "lower")]
+        if "course" in query:
+            argv += ["--course", query["course"]]
+        if "quantiles" in query:
+            argv += ["--quantiles", ",".join([str(q) for q in query["quantiles"]])]
+        argv += ["--school", query["school"]] if "school" in query else ["--all-schools"]
+        main(argv + query["files"])
+        with open(path) as f:
+            return f.read()
+
+    def test_same_as_alone(self):
+        """serially, in parallel and through the cache"""
+        expected = [self.alone(query) for query in self.queries]
+        path = self.manifest(self.queries)
+        for extra in [["--no-cache"], ["--no-cache", "--jobs", "2"], ["--cache-dir", self.directory], ["--cache-dir", self.directory, "--engine", "numpy" if numpy_imported else "python"]]:
+            main(["ecdf.py"] + extra + ["--batch", path])
+            for query, text in zip(self.queries, expected):
+                with open(query["output"]) as f:
+                    self.assertEqual(text, f.read())
+
+    def test_parsed_once(self):
+        """each file is read once however many queries use it"""
+        stats = Stats()
+        runBatch(loadManifest(self.manifest(self.queries)), stats = stats)
+        self.assertEqual(["test_data/big1.csv", "test_data/big2.csv", "test_data/big3.csv"], sorted(stats.files))
+        for this_file in stats.files:
+            self.assertEqual(2000, stats.files[this_file]["rows"])
+
+    def test_streamed(self):
+        """a query is written as soon as its files are read, before the files only later queries need are parsed"""
+        import ecdf
+        from unittest import mock
+        written = []
+        batchFile = ecdf._batchFile
+        def parse(arguments):
+            written.append((arguments[0], [os.path.exists(query["output"]) for query in self.queries]))
+            return batchFile(arguments)
+        with mock.patch.object(ecdf, "_batchFile", parse):
+            runBatch(self.queries)
+        self.assertEqual([("test_data/big1.csv", [False]*4), ("test_data/big2.csv", [False]*4), ("test_data/big3.csv", [True, False, False, False])], written)
+
+    def test_bad_manifests(self):
+        """bad manifests are rejected, and a query without data does not stop the others"""
+        for queries in [[], [{"files": ["test_data/big1.csv"]}], [{"files": ["test_data/big1.txt"], "output": "x"}], [{"files": ["test_data/big1.csv"], "output": "x", "color": "red"}],
+                        [{"files": ["test_data/big1.csv"], "output": "x", "method": "higher"}], [{"files": ["test_data/big1.csv"], "output": "x", "from": "May"}], [{"files": ["test_data/big1.csv"], "output": "x", "quantiles": [2]}]]:
+            self.assertRaises((InvalidArgumentError, FileError), loadManifest, self.manifest(queries))
+        self.assertRaises(FileError, loadManifest, os.path.join(self.directory, "missing.json"))
+        duplicate = [self.queries[0], dict(self.queries[1], output = os.path.join(self.directory, ".", "batch0.out"))]
+        self.assertRaises(InvalidArgumentError, loadManifest, self.manifest(duplicate))
+
+        queries = [{"school": "Nowhere University", "files": ["test_data/big1.csv"], "output": os.path.join(self.directory, "nowhere.out")}, self.queries[0]]
+        self.assertRaises(FileError, runBatch, queries)
+        with open(self.queries[0]["output"]) as f:
+            self.assertEqual(self.alone(self.queries[0]), f.read())
+
+    def test_ignored_options(self):
+        """the options each query sets in the manifest are rejected on the command line"""
+        path = self.manifest(self.queries)
+        for extra in [["--format", "csv"], ["--output", "out.txt"], ["--method", "linear"], ["--quantiles", "0.5"], ["--approx", "0.01"], ["--course", "Math"], ["--from", "2015-01-01"],
+                      ["--to", "2015-12-31"], ["--index"], ["--strict"], ["--snapshot", "state.snap"]]:
+            self.assertRaises(InvalidArgumentError, main, ["ecdf.py", "--no-cache"] + extra + ["--batch", path])
+            for query in self.queries:
+                self.assertFalse(os.path.exists(query["output"]))
+
+
+class TestECDFServer(unittest.TestCase):
+    """The server must answer with the same percentiles as makeECDF, and notice when its files change"""
+
+    big_files = ["test_data/big1.csv","test_data/big2.csv","test_data/big3.csv","test_data/big4.csv"]
+
+    def test_query(self):
+        """all the percentiles, and a few of them"""
+        from ecdf_server import ECDFServer
+        server = ECDFServer(self.big_files)
+        ecdf = makeECDF(getData("JKL University", self.big_files))
+        self.assertEqual(ecdf, server.query("JKL University")["mean_test_score"])
+        self.assertEqual([ecdf[0], ecdf[49], ecdf[99]], server.query("JKL University", [1, 50, 100])["mean_test_score"])
+        server.query("JKL University", [1, 50, 100])
+        self.assertEqual(1, server.state[1].hits)
+        self.assertRaises(InvalidArgumentError, server.query, "JKL University", [0])
+        self.assertRaises(KeyError, server.query, "Nowhere University")
+        self.assertRaises(FileError, ECDFServer, ["test_data/bad1.csv"])
+
+    def test_answer(self):
+        """the HTTP status of good and bad requests"""
+        from ecdf_server import ECDFServer
+        server = ECDFServer(self.big_files[:1])
+        self.assertEqual((200, {"schools": sorted(getAllData(self.big_files[:1]))}), server.answer("/schools"))
+        self.assertEqual(200, server.answer("/ecdf?school=ABC%20University&percentiles=1,100")[0])
+        self.assertEqual(400, server.answer("/ecdf?school=ABC%20University&percentiles=one")[0])
+        self.assertEqual(400, server.answer("/ecdf")[0])
+        self.assertEqual(404, server.answer("/ecdf?school=Nowhere")[0])
+        self.assertEqual(404, server.answer("/other")[0])
+
+    def test_reload(self):
+        """a changed file is read again"""
+        import tempfile, shutil
+        from ecdf_server import ECDFServer
+        directory = tempfile.mkdtemp()
+        try:
+            this_file = os.path.join(directory, "scores.csv")
+            with open(this_file, "w") as f:
+                f.write('1,"Math","ABC University",2015-04-16,90.0\n')
+            server = ECDFServer([this_file])
+            self.assertEqual(90.0, server.query("ABC University", [1])["mean_test_score"][0])
+            self.assertFalse(server.changed())
+            with open(this_file, "a") as f:
+                f.write('1,"Math","ABC University",2015-04-17,80.0\n')
+            self.assertTrue(server.changed())
+            server.load()
+            self.assertEqual(85.0, server.query("ABC University", [1])["mean_test_score"][0])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_http(self):
+        """two requests over one connection to a server on a free port"""
+        import asyncio, json
+        from ecdf_server import ECDFServer
+        server = ECDFServer(self.big_files[:2])
+
+        async def client():
+            listening = await server.start("127.0.0.1", 0)
+            port = listening.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            bodies = []
+            for target in ["/ecdf?school=XYZ%20University&percentiles=1", "/ecdf?school=XYZ%20University"]:
+                writer.write(("GET "+target+" HTTP/1.1\r\nHost: localhost\r\n\r\n").encode("latin-1"))
+                self.assertEqual(b"HTTP/1.1 200 OK\r\n", await reader.readline())
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line == b"\r\n":
+                        break
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                bodies.append(json.loads(await reader.readexactly(length)))
+            writer.close()
+            listening.close()
+            await listening.wait_closed()
+            return bodies
+
+        bodies = asyncio.run(client())
+        ecdf = makeECDF(getData("XYZ University", self.big_files[:2]))
+        self.assertEqual([ecdf[0]], bodies[0]["mean_test_score"])
+        self.assertEqual(ecdf, bodies[1]["mean_test_score"])
+
+
+class TestMakeData(unittest.TestCase):
+    """The synthetic data must be readable by getData, with the number of rows, schools and duplicates asked for"""
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def test_bad_arguments(self):
+        """the counts must be positive"""
+        from makeData import makeData
+        path = os.path.join(self.directory, "data.csv")
+        self.assertRaises(InvalidArgumentError, makeData, path, 0)
+        self.assertRaises(InvalidArgumentError, makeData, path, 10, 6, 120, 1.5)
+
+    def test_data(self):
+        """5000 rows over 8 schools, with and without NumPy"""
+        import makeData
+        path = os.path.join(self.directory, "data.csv")
+        numpy = makeData.np
+        try:
+            for module in [None, numpy]:
+                makeData.np = module
+                self.assertEqual(5000, makeData.makeData(path, 5000, 8, 50, 0.25, seed = 3))
+                with open(path) as f:
+                    lines = f.read().splitlines()
+                self.assertEqual(5000, len(lines))
+                repeats = sum([a == b for a, b in zip(lines, lines[1:])]) / float(len(lines))
+                self.assertTrue(0.2 < repeats < 0.3)
+                result = getAllData([path])
+                self.assertEqual(sorted(makeData.schoolNames(8)), sorted(result))
+                self.assertTrue(all([0 <= x <= 100 for school in result for x in result[school]]))
+        finally:
+            makeData.np = numpy
+
+
+class TestBenchmark(unittest.TestCase):
+    """The stages are timed, and slower stages are reported"""
+
+    def test_time_stages(self):
+        """timing the stages on a big file"""
+        from benchmark import timeStages, STAGES
+        seconds = timeStages("test_data/big1.csv", "ABC University")
+        self.assertEqual(sorted(STAGES), sorted(seconds))
+
+    def test_compare(self):
+        """only stages slower by more than the tolerance are reported"""
+        from benchmark import compareResults
+        old = {"results": [{"rows": 100, "engine": "python", "jobs": 1, "seconds": {"parseArg": 0.0, "getData": 1.0, "makeECDF": 0.1, "printECDF": 0.0}}]}
+        new = {"results": [{"rows": 100, "engine": "python", "jobs": 1, "seconds": {"parseArg": 0.0, "getData": 1.5, "makeECDF": 0.11, "printECDF": 0.0}},
+                           {"rows": 1000, "engine": "python", "jobs": 1, "seconds": {"parseArg": 0.0, "getData": 9.0, "makeECDF": 0.1, "printECDF": 0.0}}]}
+        regressions = compareResults(old, new, 0.2)
+        self.assertEqual(1, len(regressions))
+        self.assertTrue(regressions[0].startswith("getData on 100 rows"))
+        self.assertEqual([], compareResults(old, new, 1.0))
+
+
+def rank_error(data, ecdf):
+    """For each estimated percentile, how far (as a fraction of len(data)) its rank in the sorted data is from the rank makeECDF would pick"""
+    import bisect
+    data = sorted(data)
+    n = len(data)-1
+    worst = 0
+    for i in range(100):
+        low = bisect.bisect_left(data, ecdf[i])
+        high = bisect.bisect_right(data, ecdf[i]) - 1
+        worst = max(worst, low - int(n*i/100), int(n*i/100) - high)
+    return worst/float(len(data))
+
+
+class TestECDFClass(unittest.TestCase):
+    """The ECDF object must agree with makeECDF and with the definitions of the cdf and the Kolmogorov-Smirnov statistic"""
+
+    big_files = ["test_data/big1.csv","test_data/big2.csv","test_data/big3.csv","test_data/big4.csv"]
+
+    def setUp(self):
+        self.data = getAllData(self.big_files)
+        self.ecdfs = [ECDF(self.data[school]) for school in sorted(self.data)]
+
+    def test_bad_arguments(self):
+        """the data must be a sorted list, and the object cannot be changed"""
+        self.assertRaises(InvalidArgumentError, ECDF, "1,2")
+        self.assertRaises(InvalidArgumentError, ECDF, [])
+        self.assertRaises(InvalidArgumentError, ECDF, [2, 1])
+        self.assertEqual([1.0, 2.0], ECDF([2, 1], presorted = False).values.tolist())
+        self.assertRaises(InvalidArgumentError, self.ecdfs[0].quantile, 1.5)
+        self.assertRaises(InvalidArgumentError, self.ecdfs[0].ks, [1, 2])
+        self.assertRaises(AttributeError, setattr, self.ecdfs[0], "values", [])
+        self.assertRaises(TypeError, self.ecdfs[0].values.__setitem__, 0, 1.0)
+
+    def test_lookups(self):
+        """cdf counts the scores up to x, and quantile and percentiles agree with makeECDF"""
+        data = self.data["ABC University"]
+        ecdf = ECDF(data)
+        for x in [-1, data[0], data[10], (data[10] + data[11]) / 2, data[-1], 1000]:
+            self.assertEqual(len([value for value in data if value <= x]) / float(len(data)), ecdf.cdf(x))
+        self.assertEqual([ecdf.cdf(x) for x in data[:5]], ecdf.cdf(data[:5]))
+        self.assertEqual(makeECDF(data), ecdf.percentiles())
+        for method in METHODS:
+            self.assertEqual(makeECDF(data, quantiles = [0.1, 0.5, 0.95], method = method), ecdf.quantile([0.1, 0.5, 0.95], method))
+            self.assertEqual(makeECDF(data, quantiles = [0.3], method = method)[0], ecdf.quantile(0.3, method))
+        if numpy_imported:
+            grid = np.linspace(0, 1, 11).reshape(1, 11)
+            self.assertEqual(np.quantile(data, grid, method = "linear").tolist(), ecdf.quantile(grid, "linear").tolist())
+            self.assertEqual(ecdf.cdf(data[:5]), ecdf.cdf(np.array(data[:5])).tolist())
+
+    def test_ks(self):
+        """ks is the largest difference between the cdfs, and ksMatrix holds it for every pair"""
+        a, b = self.ecdfs[0], self.ecdfs[1]
+        points = a.values.tolist() + b.values.tolist()
+        self.assertEqual(max([abs(a.cdf(x) - b.cdf(x)) for x in points]), a.ks(b))
+        self.assertEqual(a.ks(b), b.ks(a))
+        self.assertEqual(0.0, a.ks(a))
+        self.assertEqual(1.0, ECDF([1.0, 2.0]).ks(ECDF([3.0])))
+
+        matrix = ksMatrix(self.ecdfs)
+        for i in range(len(self.ecdfs)):
+            for j in range(len(self.ecdfs)):
+                self.assertEqual(self.ecdfs[i].ks(self.ecdfs[j]), matrix[i][j])
+        self.assertEqual([], ksMatrix([]))
+
+
+class TestQuantileSketch(unittest.TestCase):
+    """The approximate percentiles must be within the rank error of the sketch, and the size of the sketch must not grow with the data"""
+
+    big_files = ["test_data/big1.csv","test_data/big2.csv","test_data/big3.csv","test_data/big4.csv"]
+
+    def test_bad_arguments(self):
+        """the rank error must be between 0 and 1"""
+        self.assertRaises(InvalidArgumentError, QuantileSketch, 0.0)
+        self.assertRaises(InvalidArgumentError, QuantileSketch, 1.5)
+        self.assertRaises(InvalidArgumentError, QuantileSketch, "0.1")
+        self.assertRaises(InvalidArgumentError, getSketch, "ABC University", self.big_files, 2.0)
+        self.assertRaises(InvalidArgumentError, approxECDF, [1, 2, 3])
+        self.assertRaises(InvalidArgumentError, approxECDF, QuantileSketch(0.1))
+
+    def test_small_data_is_exact(self):
+        """until the first level is full, the sketch keeps every value"""
+        data = [0.4,0.55,0.7,0.85, 1.97,3.77, -4.5, -2]
+        sketch = QuantileSketch(0.01)
+        for x in data:
+            sketch.add(x)
+        self.assertEqual(makeECDF(sorted(data)), approxECDF(sketch))
+
+    def test_big_files(self):
+        """checking every school of the big files against getData"""
+        for eps in [0.1, 0.05]:
+            sketches = getAllSketches(self.big_files, eps)
+            for school in sketches:
+                data = getData(school, self.big_files)
+                self.assertEqual(len(data), len(sketches[school]))
+                self.assertTrue(rank_error(data, approxECDF(sketches[school])) <= eps)
+        self.assertEqual(len(getData("ABC University", self.big_files)), len(getSketch("ABC University", self.big_files, 0.05)))
+
+    def test_synthetic(self):
+        """checking random, sorted and heavily tied data sets"""
+        import random
+        generator = random.Random(1)
+        for eps, n in [(0.1, 20000), (0.05, 50000), (0.02, 50000)]:
+            for data in [[generator.gauss(70, 15) for i in range(n)], [float(i) for i in range(n)], [float(generator.randint(0, 20)) for i in range(n)]]:
+                sketch = QuantileSketch(eps)
+                for x in data:
+                    sketch.add(x)
+                self.assertEqual(n, len(sketch))
+                self.assertTrue(sketch.size < 4*sketch.k)
+                self.assertTrue(rank_error(data, approxECDF(sketch)) <= eps)
+
+    def test_merge(self):
+        """the merge of the sketches of two halves must be as good as one sketch"""
+        import random
+        generator = random.Random(2)
+        data = [generator.random() for i in range(40000)]
+        first, second = QuantileSketch(0.05), QuantileSketch(0.05, seed = 1)
+        for x in data[:25000]:
+            first.add(x)
+        for x in data[25000:]:
+            second.add(x)
+        first.merge(second)
+        self.assertEqual(len(data), len(first))
+        self.assertEqual(len(data), sum([len(values) << level for level, values in enumerate(first.levels)]))
+        self.assertTrue(rank_error(data, approxECDF(first)) <= 0.05)
+        self.assertRaises(InvalidArgumentError, first.merge, QuantileSketch(0.1))
+
+
 class TestPrintECDF(unittest.TestCase):
     """WE will first test for bad input, and then we will test for good input. Unfortunately, because the output is so verbose, I could only check either the first few lines or the last few lines"""
 
@@ -0,0 +1,117 @@
+"""Makes synthetic csv files for testing and benchmarking ecdf.py. This is a scriptable version of makeData.ipynb.
+The program should be invoked in the following manner:
+
+python makeData.py --rows 1000000 --schools 6 --students 120 --duplicates 0.1 --seed 0 output.csv
+
+Each line has the form student_id,course_name,school_name,test_date,test_score. As in the notebook, the
+scores of a student are drawn around a mean that depends on the student_id, and each line goes to a random
+school and course. --duplicates is the fraction of lines that repeat the line before them.
+With NumPy the lines are drawn a chunk at a time, which is what makes 10^8 rows practical.
+"""
+
+import sys
+import random
+
+from ecdf import InvalidArgumentError, FileError, parseOptions
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COURSES = ["Geography", "Math", "Science", "Latin", "English", "Psychology", "Art", "Music", "History"]
+
+#The first schools have the names used in test_data, the others are numbered
+SCHOOLS = ["ABC", "DEF", "GHI", "JKL", "MNO", "XYZ"]
+
+#The options understood by this program, and the type of the value each one takes
+OPTIONS = {"--rows": int, "--schools": int, "--students": int, "--duplicates": float, "--seed": int}
+
+#The lines are drawn and written this many at a time
+CHUNK_ROWS = 100000
+
+
+def schoolNames(schools):
+    """Returns the names of that many schools"""
+
+    return [(SCHOOLS[i] if i < len(SCHOOLS) else "School "+str(i)) + " University" for i in range(schools)]
+
+
+def makeData(path, rows, schools = 6, students = 120, duplicates = 0.0, seed = 0):
+    """Writes rows lines of synthetic data to the file path"""
+
+    if not all([isinstance(x, int) and x > 0 for x in [rows, schools, students]]):
+        raise InvalidArgumentError("The number of rows, schools and students must be positive integers")
+    if not isinstance(duplicates, float) or not 0 <= duplicates < 1:
+        raise InvalidArgumentError("The fraction of duplicates must be a float between 0 and 1")
+
+    names = schoolNames(schools)
+    try:
+        f = open(path, "w")
+    except IOError:
+        raise FileError("Could not open "+str(path)+" for writing.")
+    try:
+        written = 0
+        chunks = _numpyChunks if np is not None else _pythonChunks
+        for lines in chunks(rows, names, students, duplicates, seed):
+            f.writelines(lines)
+            written += len(lines)
+    finally:
+        f.close()
+    return written
+
+
+def _pythonChunks(rows, names, students, duplicates, seed):
+    """Yields lists of lines, drawn one at a time with the random module"""
+
+    generator = random.Random(seed)
+    line = None
+    for start in range(0, rows, CHUNK_ROWS):
+        lines = []
+        for i in range(min(CHUNK_ROWS, rows - start)):
+            if line is None or generator.random() >= duplicates:
+                student_id = generator.randrange(students)
+                mu = student_id % 100 + 30
+                score = abs(generator.gauss(mu, mu/7.0))
+                if score > 100:
+                    score = 200 - score
+                line = "{0},{1},{2},2015-{3:02d}-{4:02d},{5}\n".format(student_id, generator.choice(COURSES), generator.choice(names),
+                                                                       generator.randint(1, 12), generator.randint(1, 28), int(round(score)))
+            lines.append(line)
+        yield lines
+
+
+def _numpyChunks(rows, names, students, duplicates, seed):
+    """Yields lists of lines, drawing each column of a chunk with one NumPy call"""
+
+    generator = np.random.RandomState(seed)
+    previous = None
+    for start in range(0, rows, CHUNK_ROWS):
+        n = min(CHUNK_ROWS, rows - start)
+        student_ids = generator.randint(students, size=n)
+        mu = student_ids % 100 + 30
+        scores = np.abs(generator.normal(mu, mu/7.0))
+        scores = np.rint(np.where(scores > 100, 200 - scores, scores)).astype(np.int64)
+        courses = generator.randint(len(COURSES), size=n)
+        schools = generator.randint(len(names), size=n)
+        months = generator.randint(1, 13, size=n)
+        days = generator.randint(1, 29, size=n)
+        lines = ["{0},{1},{2},2015-{3:02d}-{4:02d},{5}\n".format(*row) for row in
+                 zip(student_ids.tolist(), [COURSES[c] for c in courses.tolist()], [names[s] for s in schools.tolist()], months.tolist(), days.tolist(), scores.tolist())]
+
+        #A duplicate repeats the line before it, which may itself be a duplicate
+        repeat = generator.random_sample(n) < duplicates
+        for i in np.flatnonzero(repeat).tolist():
+            if i > 0:
+                lines[i] = lines[i-1]
+            elif previous is not None:
+                lines[i] = previous
+        previous = lines[-1]
+        yield lines
+
+
+if __name__ == '__main__':
+    options, argv = parseOptions(sys.argv, OPTIONS)
+    if len(argv) != 2:
+        raise InvalidArgumentError("""This program must be run with the following format: \npython makeData.py --rows 1000000 output.csv""")
+    makeData(argv[1], options.get("rows", 10000), options.get("schools", 6), options.get("students", 120), options.get("duplicates", 0.0), options.get("seed", 0))